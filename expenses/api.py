@@ -0,0 +1,237 @@
+"""
+Async JSON API over expenses, for dashboards polling the data.
+
+Every handler is a coroutine and reads through the async ORM, so one ASGI
+worker can keep many slow polls in flight. GET responses carry an ETag
+built from the data version (see expenses.caching) and the normalized
+query string; a request whose If-None-Match still matches gets a 304
+before any query runs.
+
+    GET    api/expenses/                 filtered, sorted, cursor-paginated list
+    POST   api/expenses/                 create
+    GET    api/expenses/<pk>/            one expense
+    PUT    api/expenses/<pk>/            replace (PATCH: update the given fields)
+    DELETE api/expenses/<pk>/            delete
+    GET    api/summary/category/         totals per category
+    GET    api/summary/year-month/       totals per month
+    GET    api/reports/timeseries/       per-period, per-category pivot
+
+The list and summaries take the list page's filters (`name`, `date_from`,
+`date_to`, `categories`, `sort`); the list also `page_size` and `cursor`,
+the time series `granularity` (day, week, month, quarter or year).
+"""
+import hashlib
+import json
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db.models import Count, Sum
+from django.forms.models import model_to_dict
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags, quote_etag
+from django.views.generic.base import View
+
+from . import caching
+from .forms import ExpenseForm, ExpenseSearchForm, TimeSeriesForm
+from .models import Expense
+from .pagination import KeysetPaginator
+from .reports import asummary_per_category, asummary_per_year_month
+from .timeseries import atime_series
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+CENTS = Decimal('0.01')
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.payload = {'error': message, **extra}
+
+
+def format_amount(value):
+    # Sums come back from SQLite with arbitrary precision.
+    return str(Decimal(value or 0).quantize(CENTS))
+
+
+def serialize_expense(obj):
+    return {
+        'id': obj.pk,
+        'date': obj.date.isoformat(),
+        'name': obj.name,
+        'amount': format_amount(obj.amount),
+        'category_id': obj.category_id,
+        'category': obj.category.name if obj.category_id else None,
+    }
+
+
+def format_optional(value):
+    return None if value is None else format_amount(value)
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    tags = parse_etags(header)
+    return '*' in tags or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags)
+
+
+class ApiView(View):
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except ApiError as e:
+            return JsonResponse(e.payload, status=e.status)
+
+    async def get(self, request, *args, **kwargs):
+        version = await caching.adata_version()
+        query = caching.normalize_params(request.GET)
+        digest = hashlib.md5(f'{request.path}?{query}'.encode()).hexdigest()[:16]
+        etag = quote_etag(f'{version}-{digest}')
+        if etag_matches(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
+        response = JsonResponse(await self.get_data(request, *args, **kwargs))
+        response['ETag'] = etag
+        return response
+
+    async def get_data(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    async def filter_expenses(self, request):
+        """Like ExpenseFilterMixin, but invalid filters are a 400, not ignored."""
+        form = ExpenseSearchForm(request.GET)
+        if not await sync_to_async(form.is_valid)():
+            raise ApiError(400, 'Invalid filters.', errors=form.errors.get_json_data())
+        queryset = Expense.objects.select_related('category')
+        return form.order_queryset(form.filter_queryset(queryset)), form.cleaned_data
+
+    @staticmethod
+    def parse_body(request):
+        try:
+            data = json.loads(request.body)
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ApiError(400, f'Invalid JSON: {e}')
+        if not isinstance(data, dict):
+            raise ApiError(400, 'Expected a JSON object.')
+        return data
+
+    @staticmethod
+    async def save(form):
+        if not await sync_to_async(form.is_valid)():
+            raise ApiError(400, 'Invalid expense.', errors=form.errors.get_json_data())
+        return await sync_to_async(form.save)()
+
+
+class ExpenseCollectionApi(ApiView):
+    query_budget = 8  # a create; listing takes 3
+
+    async def get_data(self, request):
+        queryset, filters = await self.filter_expenses(request)
+        try:
+            page_size = min(int(request.GET.get('page_size', PAGE_SIZE)), MAX_PAGE_SIZE)
+        except ValueError:
+            raise ApiError(400, 'page_size must be a number.')
+        try:
+            page = await KeysetPaginator(queryset, max(page_size, 1)).apage(
+                request.GET.get('cursor'))
+        except InvalidPage as e:
+            raise ApiError(400, str(e))
+
+        stats = await caching.aget_or_set(
+            'api-stats', caching.normalize_params(request.GET, exclude=('cursor', 'page_size')),
+            lambda: queryset.order_by().aaggregate(count=Count('pk'), total=Sum('amount')))
+        return {
+            'count': stats['count'],
+            'total': format_amount(stats['total']),
+            'results': [serialize_expense(obj) for obj in page],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        }
+
+    async def post(self, request):
+        obj = await self.save(ExpenseForm(self.parse_body(request)))
+        return JsonResponse(serialize_expense(obj), status=201)
+
+
+class ExpenseDetailApi(ApiView):
+    query_budget = 9
+
+    async def get_object(self, pk):
+        try:
+            return await Expense.objects.select_related('category').aget(pk=pk)
+        except Expense.DoesNotExist:
+            raise ApiError(404, f'No expense {pk}.')
+
+    async def get_data(self, request, pk):
+        return serialize_expense(await self.get_object(pk))
+
+    async def put(self, request, pk, partial=False):
+        obj = await self.get_object(pk)
+        data = self.parse_body(request)
+        if partial:
+            data = {**model_to_dict(obj, fields=ExpenseForm._meta.fields), **data}
+        obj = await self.save(ExpenseForm(data, instance=obj))
+        return JsonResponse(serialize_expense(obj))
+
+    async def patch(self, request, pk):
+        return await self.put(request, pk, partial=True)
+
+    async def delete(self, request, pk):
+        obj = await self.get_object(pk)
+        await obj.adelete()
+        return HttpResponse(status=204)
+
+
+class CategorySummaryApi(ApiView):
+    query_budget = 3
+
+    async def get_data(self, request):
+        queryset, filters = await self.filter_expenses(request)
+        summary = await asummary_per_category(queryset, filters)
+        return {'results': [
+            {'category': name, 'total': format_amount(total)} for name, total in summary.items()
+        ]}
+
+
+class YearMonthSummaryApi(ApiView):
+    query_budget = 2
+
+    async def get_data(self, request):
+        queryset, filters = await self.filter_expenses(request)
+        summary = await asummary_per_year_month(queryset, filters)
+        return {'results': [
+            {'period': period.strftime('%Y-%m'), 'total': format_amount(total)}
+            for period, total in summary.items()
+        ]}
+
+
+class TimeSeriesApi(ApiView):
+    query_budget = 3
+
+    async def get_data(self, request):
+        queryset, filters = await self.filter_expenses(request)
+        form = TimeSeriesForm(request.GET)
+        if not form.is_valid():
+            raise ApiError(400, 'Invalid granularity.', errors=form.errors.get_json_data())
+        granularity = form.cleaned_data['granularity']
+        series = await atime_series(queryset, granularity, filters)
+        return {
+            'granularity': granularity,
+            'columns': series.columns,
+            'results': [
+                {
+                    'period': row.period.isoformat(),
+                    'label': row.label,
+                    'amounts': [format_amount(value) for value in row.amounts],
+                    'running': [format_amount(value) for value in row.running],
+                    'deltas': [format_optional(value) for value in row.deltas],
+                    'total': format_amount(row.total),
+                    'running_total': format_amount(row.running_total),
+                    'delta': format_optional(row.delta),
+                }
+                for row in series.rows()
+            ],
+        }
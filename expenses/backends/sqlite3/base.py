@@ -0,0 +1,48 @@
+"""
+SQLite backend with per-connection tuning.
+
+Two extra OPTIONS are taken out before the connection is opened:
+
+    'pragmas': {'journal_mode': 'wal', 'synchronous': 'normal', ...}
+        PRAGMA statements run on every new connection, in order.
+    'transaction_mode': 'IMMEDIATE'
+        How `atomic()` begins a transaction: DEFERRED (SQLite's default),
+        IMMEDIATE or EXCLUSIVE. IMMEDIATE takes the write lock up front, so
+        concurrent writers queue on the busy timeout instead of failing
+        with "database is locked" when a read transaction is upgraded.
+
+Everything else behaves like django.db.backends.sqlite3.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    @property
+    def pragmas(self):
+        return self.settings_dict['OPTIONS'].get('pragmas', {})
+
+    @property
+    def transaction_mode(self):
+        mode = (self.settings_dict['OPTIONS'].get('transaction_mode') or 'DEFERRED').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f'transaction_mode must be one of {", ".join(TRANSACTION_MODES)}, not {mode!r}.')
+        return mode
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
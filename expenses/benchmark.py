@@ -0,0 +1,366 @@
+"""
+Benchmark the expense pages at a given data size.
+
+Each scenario is a GET through the Django test client against whatever is
+in the default database, so the whole stack is measured: middleware, ORM,
+SQL and template rendering. For every scenario we record the p50/p95
+latency over `repeat` requests, the number of SQL queries and the peak
+Python memory of one extra request traced with `tracemalloc` (tracing is
+kept out of the timed runs because it slows allocation-heavy code down).
+
+`run_mixed()` instead measures throughput: reader threads loop over the
+list and report pages while writer threads post new expenses, the load
+that makes SQLite's locking visible. Compare a run under the default
+settings with one under EXPENSES_DB_PROFILE=production.
+
+Results are plain dicts, so a run can be dumped to JSON and compared
+against an earlier one with `compare()`.
+"""
+import datetime
+import itertools
+import math
+import os
+import platform
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import django
+from django.conf import settings
+from django.db import OperationalError, connection, connections
+from django.db.models import Max
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from . import caching, synthetic
+from .models import Expense
+from .pagination import KeysetPaginator
+from .querybudget import count_queries
+from .routers import get_read_alias
+from .views import ExpenseListView
+
+SIZES = (10_000, 1_000_000, 10_000_000)
+REPEAT = 20
+DEEP_FRACTION = 0.9
+DURATION = 10
+READERS = 8
+WRITERS = 2
+
+
+@dataclass
+class Scenario:
+    name: str
+    url: str
+    params: dict = field(default_factory=dict)
+    settings: dict = field(default_factory=dict)
+
+
+def build_scenarios(category_id=None):
+    """
+    Scenarios for the data currently in the database. `category_id` is the
+    category to filter on, normally the most popular one.
+    """
+    expense_list = reverse('expenses:expense-list')
+    last = Expense.objects.aggregate(last=Max('date'))['last'] or datetime.date.today()
+    month_start = last.replace(day=1)
+    per_page = ExpenseListView.paginate_by
+    total = Expense.objects.count()
+    deep_index = int(total * DEEP_FRACTION) // per_page * per_page
+
+    result = [
+        Scenario('list', expense_list),
+        Scenario('list_month', expense_list, {
+            'date_from': month_start.isoformat(), 'date_to': last.isoformat()}),
+        # Not month-aligned, so the summaries are aggregated live instead of
+        # read from the rollups.
+        Scenario('list_range', expense_list, {
+            'date_from': (last - datetime.timedelta(days=364)).isoformat(),
+            'date_to': (last - datetime.timedelta(days=3)).isoformat()}),
+        Scenario('list_search', expense_list, {'name': 'coffee'}),
+        Scenario('list_sort_amount', expense_list, {'sort': '-amount'}),
+        Scenario('list_deep_offset', expense_list, {'page': deep_index // per_page + 1}),
+    ]
+    if category_id is not None:
+        result.append(Scenario('list_category', expense_list, {'categories': category_id}))
+    if deep_index:
+        queryset = Expense.objects.order_by('-date', '-pk')
+        boundary = queryset[deep_index - 1]
+        cursor = KeysetPaginator(queryset, per_page).encode_cursor(boundary, deep_index, 'next')
+        result.append(Scenario('list_deep_keyset', expense_list, {'cursor': cursor},
+                               {'EXPENSES_PAGINATION_MODE': 'keyset'}))
+    result.append(Scenario('category_list', reverse('expenses:category-list')))
+    result.append(Scenario('report_year', reverse('expenses:expense-report'),
+                           {'granularity': 'year'}))
+    result.append(Scenario('report_week', reverse('expenses:expense-report'),
+                           {'granularity': 'week', 'date_from': month_start.isoformat()}))
+    return result
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile; deterministic for small samples."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def measure(client, scenario, repeat=REPEAT, warm=False):
+    """Time `repeat` requests for `scenario` and return a result dict."""
+    cache = caching.get_cache()
+    timings, queries = [], None
+    with override_settings(**scenario.settings):
+        for _ in range(repeat):
+            if not warm:
+                cache.clear()
+            with count_queries() as stats:
+                start = time.perf_counter()
+                response = client.get(scenario.url, scenario.params)
+                timings.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f'{scenario.name}: {scenario.url} returned {response.status_code}')
+            queries = stats.count if queries is None else max(queries, stats.count)
+
+        if not warm:
+            cache.clear()
+        tracemalloc.start()
+        try:
+            client.get(scenario.url, scenario.params)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'scenario': scenario.name,
+        'url': scenario.url,
+        'params': {key: str(value) for key, value in scenario.params.items()},
+        'repeat': repeat,
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3),
+        'queries': queries,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run(size, scenarios, repeat=REPEAT, warm=False):
+    # DEBUG would keep every query in connection.queries.
+    with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+        client = Client()
+        return [dict(measure(client, scenario, repeat, warm), size=size)
+                for scenario in scenarios]
+
+
+@contextmanager
+def benchmark_database(db_file, keepdb=False):
+    """
+    Point the default alias (and the read alias, if any) at `db_file`,
+    created from the migrations, for the duration of the block. The
+    expenses cache moves to a temporary directory as well: the benchmark
+    clears it between requests and must not touch the application's.
+    """
+    connection.settings_dict.setdefault('TEST', {})['NAME'] = db_file
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, keepdb=keepdb)
+    reader = get_read_alias()
+    if reader:
+        connections[reader].close()
+        old_reader = connections[reader].settings_dict['NAME']
+        connections[reader].settings_dict['NAME'] = f'file:{os.path.abspath(db_file)}?mode=ro'
+    alias = caching.get_cache_alias()
+    try:
+        with tempfile.TemporaryDirectory(prefix='expenses-benchmark-cache-') as location, \
+                override_settings(CACHES={**settings.CACHES, alias: {
+                    **settings.CACHES[alias], 'LOCATION': location}}):
+            yield
+    finally:
+        if reader:
+            connections[reader].close()
+            connections[reader].settings_dict['NAME'] = old_reader
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def ensure_size(size, categories, seed=0, log=None):
+    """
+    Grow (or regenerate) the expenses to `size` rows and return the
+    category ids, most popular first.
+    """
+    existing = Expense.objects.count()
+    if existing > size:
+        synthetic.clear()
+        existing = 0
+    if existing == size:
+        return synthetic.generate(categories, 0)
+    if log:
+        log(f'Generating {size - existing} expenses...')
+    # Seeded from the row count the step starts at, so runs with the same
+    # sizes and seed benchmark the same data.
+    return synthetic.generate(categories, size - existing, seed=seed * 1_000_003 + existing)
+
+
+def mixed_reads(category_id=None):
+    """The read side of the mixed load: list pages and reports."""
+    expense_list = reverse('expenses:expense-list')
+    report = reverse('expenses:expense-report')
+    reads = [
+        (expense_list, {}),
+        (expense_list, {'name': 'coffee'}),
+        (expense_list, {'sort': '-amount'}),
+        (report, {'granularity': 'month'}),
+        (reverse('expenses:category-list'), {}),
+    ]
+    if category_id is not None:
+        reads.append((expense_list, {'categories': category_id}))
+    return reads
+
+
+def _worker(kind, work, deadline, results, lock):
+    timings, errors = [], 0
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = work()
+            except OperationalError:  # "database is locked"
+                ok = False
+            if ok:
+                timings.append(time.perf_counter() - start)
+            else:
+                errors += 1
+    finally:
+        connections.close_all()
+    with lock:
+        results[kind][0].extend(timings)
+        results[kind][1] += errors
+
+
+def run_mixed(category_ids, duration=DURATION, readers=READERS, writers=WRITERS, seed=0):
+    """
+    Run `readers` + `writers` client threads for `duration` seconds and
+    return throughput, latency and error counts per kind of request.
+    """
+    reads = mixed_reads(category_ids[0] if category_ids else None)
+    expense_create = reverse('expenses:expense-create')
+    results = {'read': [[], 0], 'write': [[], 0]}
+    lock = threading.Lock()
+
+    def reader(n):
+        client, urls = Client(), itertools.cycle(reads[n % len(reads):] + reads[:n % len(reads)])
+
+        def work():
+            url, params = next(urls)
+            return client.get(url, params).status_code == 200
+        return work
+
+    def writer(n):
+        client, rng = Client(), random.Random(seed * 1_000_003 + n)
+
+        def work():
+            response = client.post(expense_create, {
+                'name': f'load {rng.randrange(1000)}',
+                'amount': f'{rng.randrange(1, 10000) / 100:.2f}',
+                'date': (synthetic.END_DATE - datetime.timedelta(days=rng.randrange(365))).isoformat(),
+                'category': rng.choice(category_ids) if category_ids else '',
+            })
+            return response.status_code == 302
+        return work
+
+    # DEBUG would keep every query in connection.queries.
+    with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+        connections.close_all()
+        deadline = time.perf_counter() + duration
+        threads = [
+            threading.Thread(target=_worker, args=(kind, make(n), deadline, results, lock))
+            for kind, make, count in (('read', reader, readers), ('write', writer, writers))
+            for n in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    rows = []
+    for kind, count in (('read', readers), ('write', writers)):
+        timings, errors = results[kind]
+        rows.append({
+            'scenario': f'mixed_{kind}',
+            'threads': count,
+            'duration_s': duration,
+            'requests': len(timings),
+            'errors': errors,
+            'per_second': round(len(timings) / duration, 1),
+            'p50_ms': round(statistics.median(timings) * 1000, 3) if timings else None,
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3) if timings else None,
+        })
+    return rows
+
+
+def metadata(**extra):
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'sqlite': getattr(connection.Database, 'sqlite_version', None),
+        'platform': platform.platform(),
+        'pagination_mode': getattr(settings, 'EXPENSES_PAGINATION_MODE', 'offset'),
+        'journal_mode': journal_mode(),
+        'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+        'read_database': get_read_alias(),
+        **extra,
+    }
+
+
+def journal_mode():
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        return cursor.fetchone()[0]
+
+
+def compare(baseline, current):
+    """
+    Pair up results by `(size, scenario)` and return rows with the p50/p95
+    ratios (current / baseline; below 1 is faster) and the query delta.
+    """
+    before = {(row['size'], row['scenario']): row for row in baseline['results']}
+    rows = []
+    for row in current['results']:
+        old = before.get((row['size'], row['scenario']))
+        if old is None:
+            continue
+        rows.append({
+            'size': row['size'],
+            'scenario': row['scenario'],
+            'p50_ratio': round(row['p50_ms'] / old['p50_ms'], 3) if old['p50_ms'] else None,
+            'p95_ratio': round(row['p95_ms'] / old['p95_ms'], 3) if old['p95_ms'] else None,
+            'queries_delta': row['queries'] - old['queries'],
+            'memory_ratio': (round(row['peak_memory_kb'] / old['peak_memory_kb'], 3)
+                             if old['peak_memory_kb'] else None),
+        })
+    return rows
+
+
+def compare_mixed(baseline, current):
+    """Like `compare()` for `run_mixed()` results: throughput ratio and error delta."""
+    before = {row['scenario']: row for row in baseline['results']}
+    rows = []
+    for row in current['results']:
+        old = before.get(row['scenario'])
+        if old is None:
+            continue
+        rows.append({
+            'scenario': row['scenario'],
+            'throughput_ratio': (round(row['per_second'] / old['per_second'], 3)
+                                 if old['per_second'] else None),
+            'p50_ratio': (round(row['p50_ms'] / old['p50_ms'], 3)
+                          if old['p50_ms'] and row['p50_ms'] else None),
+            'p95_ratio': (round(row['p95_ms'] / old['p95_ms'], 3)
+                          if old['p95_ms'] and row['p95_ms'] else None),
+            'errors_delta': row['errors'] - old['errors'],
+        })
+    return rows
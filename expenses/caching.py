@@ -0,0 +1,107 @@
+"""
+Caching of expense list pieces keyed by normalized query parameters.
+
+Every key embeds a data version. Any write to Expense or Category bumps it
+(see `invalidate`), which orphans all previous entries at once; the cache
+backend's TTL / LRU culling then reclaims them. The backend is the cache
+alias named by `settings.EXPENSES_CACHE_ALIAS`; it must be shared between
+workers (e.g. file-based) for invalidation to reach all of them.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_KEY = 'expenses:data-version'
+
+
+def get_cache_alias():
+    return getattr(settings, 'EXPENSES_CACHE_ALIAS', 'default')
+
+
+def get_cache():
+    return caches[get_cache_alias()]
+
+
+def data_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Restart from the clock, so an evicted counter never goes back to
+        # a version that still has entries.
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def adata_version():
+    cache = get_cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, time.time_ns(), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate(using='default'):
+    """
+    Invalidate everything cached so far. Bumps now, so the writing request
+    doesn't read its own stale data, and again on commit, so entries that
+    concurrent requests computed from pre-commit data are dropped too.
+    """
+    bump_version()
+    transaction.on_commit(bump_version, using=using)
+
+
+def normalize_params(params, exclude=()):
+    """Canonical query string for `params` (a QueryDict) ignoring empty values."""
+    return urlencode(sorted(
+        (key, value)
+        for key in params if key not in exclude
+        for value in params.getlist(key) if value
+    ))
+
+
+def make_key(prefix, params, version=None):
+    digest = hashlib.md5(params.encode()).hexdigest()
+    if version is None:
+        version = data_version()
+    return f'expenses:{prefix}:{version}:{digest}'
+
+
+def get_or_set(prefix, params, default, timeout=None):
+    """`cache.get_or_set` under a versioned key; `timeout=None` means the backend default."""
+    cache = get_cache()
+    if timeout is None:
+        timeout = cache.default_timeout
+    return cache.get_or_set(make_key(prefix, params), default, timeout)
+
+
+async def aget_or_set(prefix, params, default, timeout=None):
+    """Async `get_or_set`; `default` is a coroutine function."""
+    cache = get_cache()
+    if timeout is None:
+        timeout = cache.default_timeout
+    key = make_key(prefix, params, await adata_version())
+    value = await cache.aget(key)
+    if value is None:
+        value = await default()
+        await cache.aset(key, value, timeout)
+    return value
+
+
+def cached_count(queryset, timeout=None):
+    queryset = queryset.order_by()
+    sql, params = queryset.query.sql_with_params()
+    return get_or_set('count', f'{sql}{params!r}', queryset.count, timeout)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+from django.utils.module_loading import import_string
+
+from . import caching
+
+
+@register()
+def check_background_reports_cache(app_configs, **kwargs):
+    """
+    Background reports are versioned by the data version in the expenses
+    cache; with a per-process cache, writes from other processes never
+    change it and outdated results are served indefinitely.
+    """
+    if not getattr(settings, 'EXPENSES_BACKGROUND_REPORTS', False):
+        return []
+    alias = caching.get_cache_alias()
+    path = settings.CACHES.get(alias, {}).get('BACKEND')
+    backend = import_string(path) if path else None
+    if backend is None or not issubclass(backend, (LocMemCache, DummyCache)):
+        return []
+    return [Error(
+        'EXPENSES_BACKGROUND_REPORTS needs a cache shared between processes.',
+        hint=f"CACHES[{alias!r}] uses {backend.__name__}, which keeps the data version "
+             'per process. Use a shared backend such as FileBasedCache.',
+        id='expenses.E001',
+    )]
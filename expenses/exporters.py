@@ -0,0 +1,53 @@
+"""
+Constant-memory export of expense querysets as CSV or NDJSON.
+
+Rows are read as tuples with `values_list(...).iterator(chunk_size)`, so
+neither model instances nor the whole result set are ever held in memory.
+"""
+import csv
+import json
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+COLUMNS = ('id', 'date', 'name', 'amount', 'category')
+LOOKUPS = ('pk', 'date', 'name', 'amount', 'category__name')
+CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """File-like object handing back what csv.writer writes to it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_rows(queryset, chunk_size=CHUNK_SIZE):
+    return queryset.values_list(*LOOKUPS).iterator(chunk_size=chunk_size)
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for pk, date, name, amount, category in rows:
+        yield writer.writerow((pk, date.isoformat(), name, amount, category or ''))
+
+
+def iter_ndjson(rows):
+    for pk, date, name, amount, category in rows:
+        yield json.dumps({
+            'id': pk,
+            'date': date.isoformat(),
+            'name': name,
+            'amount': str(amount),
+            'category': category,
+        }) + '\n'
+
+
+def export(queryset, format, chunk_size=CHUNK_SIZE):
+    """Yield `queryset` serialized as `format` ('csv' or 'ndjson'), line by line."""
+    if format not in FORMATS:
+        raise ValueError(f'Unknown export format {format!r}, expected one of {tuple(FORMATS)}.')
+    rows = iter_rows(queryset, chunk_size)
+    return iter_csv(rows) if format == 'csv' else iter_ndjson(rows)
@@ -1,5 +1,21 @@
 from django import forms
-from .models import Expense
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+
+from . import search
+from .importers import FORMATS
+from .timeseries import GRANULARITIES
+from .models import Expense, Category
+
+SORT_CHOICES = (
+    ('', 'relevance when searching, otherwise newest first'),
+    ('-date', 'date (newest first)'),
+    ('date', 'date (oldest first)'),
+    ('category', 'category (A-Z)'),
+    ('-category', 'category (Z-A)'),
+    ('-amount', 'amount (highest first)'),
+    ('amount', 'amount (lowest first)'),
+)
 
 
 class ExpenseSearchForm(forms.ModelForm):
@@ -7,6 +23,72 @@ class ExpenseSearchForm(forms.ModelForm):
         model = Expense
         fields = ('name',)
 
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    categories = forms.ModelMultipleChoiceField(
+        queryset=Category.objects.all(), required=False)
+    sort = forms.ChoiceField(choices=SORT_CHOICES, required=False)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['name'].required = False
+
+    def filter_queryset(self, queryset):
+        data = self.cleaned_data
+        name = data.get('name', '').strip()
+        if name:
+            queryset = search.search(queryset, name, ranked=not data.get('sort'))
+        if data.get('date_from'):
+            queryset = queryset.filter(date__gte=data['date_from'])
+        if data.get('date_to'):
+            queryset = queryset.filter(date__lte=data['date_to'])
+        if data.get('categories'):
+            queryset = queryset.filter(category__in=list(data['categories']))
+        return queryset
+
+    def order_queryset(self, queryset):
+        sort = self.cleaned_data.get('sort')
+        if not sort:
+            if 'search_rank' in queryset.query.annotations:
+                return queryset.order_by('search_rank', 'pk')
+            return queryset
+        field = sort.lstrip('-')
+        if field == 'category':
+            # Sort on a non-null key so keyset pagination can seek on it.
+            queryset = queryset.annotate(
+                category_name=Coalesce('category__name', Value('')))
+            field = 'category_name'
+        direction = '-' if sort.startswith('-') else ''
+        return queryset.order_by(f'{direction}{field}', f'{direction}pk')
+
+
+class TimeSeriesForm(forms.Form):
+    granularity = forms.ChoiceField(choices=[(g, g) for g in GRANULARITIES], initial='month',
+                                    required=False)
+
+    def clean_granularity(self):
+        return self.cleaned_data['granularity'] or 'month'
+
+
+class ExpenseForm(forms.ModelForm):
+    class Meta:
+        model = Expense
+        fields = ('name', 'amount', 'date', 'category')
+
+
+class ExpenseImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV with a name,amount,date,category header, '
+                                     'or a JSON array / NDJSON of such objects.')
+    format = forms.ChoiceField(choices=[('', 'from file name')] + [(f, f) for f in FORMATS],
+                               required=False)
+    dry_run = forms.BooleanField(required=False, help_text='Only validate the file.')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        file = cleaned_data.get('file')
+        if file and not cleaned_data.get('format'):
+            extension = file.name.rsplit('.', 1)[-1].lower()
+            cleaned_data['format'] = 'json' if extension in ('ndjson', 'jsonl') else extension
+            if cleaned_data['format'] not in FORMATS:
+                self.add_error('format', 'Cannot tell the format from the file name.')
+        return cleaned_data
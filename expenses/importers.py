@@ -0,0 +1,165 @@
+"""
+Streaming bulk import of expenses from CSV or JSON.
+
+Rows are dicts with `name`, `amount`, optional `date` (ISO, defaults to
+today) and optional `category` (a category name, created if missing). They
+are parsed lazily, validated with the Expense model fields and written with
+`bulk_create` one transaction per batch, so memory use is bounded by the
+batch size rather than the input size.
+"""
+import csv
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Category, Expense
+
+FORMATS = ('csv', 'json')
+JSON_CHUNK_SIZE = 64 * 1024
+# Row errors kept per import; the rest are only counted.
+MAX_ERRORS = 100
+
+
+def iter_csv_rows(stream):
+    for row in csv.DictReader(stream):
+        yield {key.strip().lower(): value for key, value in row.items() if key}
+
+
+def iter_json_rows(stream):
+    """
+    Yield objects from a JSON array or from newline-delimited JSON without
+    loading the whole document.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+
+    while True:
+        # Whatever sits between two top-level values is whitespace or the
+        # punctuation of the enclosing array.
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in '[,]'):
+            pos += 1
+        if pos < len(buffer):
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield value
+                pos = end
+                continue
+        elif eof:
+            return
+
+        chunk = stream.read(JSON_CHUNK_SIZE)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+
+def iter_rows(stream, format):
+    if format == 'csv':
+        return iter_csv_rows(stream)
+    if format == 'json':
+        return iter_json_rows(stream)
+    raise ValueError(f'Unknown import format {format!r}, expected one of {FORMATS}.')
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    created_categories: list = field(default_factory=list)
+    # The first `max_errors` (row number, message) pairs; `failed` counts all.
+    errors: list = field(default_factory=list)
+    failed: int = 0
+    max_errors: int = MAX_ERRORS
+
+    def add_error(self, number, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((number, message))
+
+
+class ExpenseImporter:
+    """
+    Import rows in batches of `batch_size`. With `dry_run`, validate and
+    resolve categories but write nothing. Only the first `max_errors` row
+    errors are kept.
+    """
+
+    def __init__(self, batch_size=1000, dry_run=False, using='default', max_errors=MAX_ERRORS):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.max_errors = max_errors
+        self.using = using
+        self.categories = dict(
+            Category.objects.using(using).values_list('name', 'id'))
+        self.fields = {name: Expense._meta.get_field(name) for name in ('name', 'amount', 'date')}
+        self.category_field = Category._meta.get_field('name')
+
+    def run(self, rows):
+        result = ImportResult(max_errors=self.max_errors)
+        rows = enumerate(rows, 1)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return result
+            result.rows += len(batch)
+            self.import_batch(batch, result)
+
+    def import_batch(self, batch, result):
+        expenses = []
+        for number, row in batch:
+            try:
+                expenses.append(self.build(row))
+            except ValidationError as e:
+                result.add_error(number, '; '.join(e.messages))
+            except (AttributeError, TypeError):
+                result.add_error(number, 'Row must be an object with name, amount, date and category.')
+
+        missing = {name for _, name in expenses if name and name not in self.categories}
+        result.created_categories += sorted(missing)
+        result.created += len(expenses)
+        if self.dry_run:
+            self.categories.update(dict.fromkeys(missing))
+            return
+
+        with transaction.atomic(using=self.using):
+            if missing:
+                self.create_categories(missing)
+            for expense, category_name in expenses:
+                expense.category_id = self.categories.get(category_name) if category_name else None
+            Expense.objects.using(self.using).bulk_create(
+                [expense for expense, _ in expenses], batch_size=self.batch_size)
+
+    def create_categories(self, names):
+        categories = Category.objects.using(self.using)
+        categories.bulk_create([Category(name=name) for name in names], ignore_conflicts=True)
+        self.categories.update(categories.filter(name__in=names).values_list('name', 'id'))
+
+    def build(self, row):
+        values = {}
+        errors = {}
+        for name, model_field in self.fields.items():
+            value = row.get(name)
+            if isinstance(value, str):
+                value = value.strip() or None
+            if value is None and model_field.has_default():
+                value = model_field.get_default()
+            try:
+                values[name] = model_field.clean(value, None)
+            except ValidationError as e:
+                errors[name] = e.messages
+        category = str(row.get('category') or '').strip() or None
+        if category:
+            try:
+                self.category_field.run_validators(category)
+            except ValidationError as e:
+                errors['category'] = e.messages
+        if errors:
+            raise ValidationError([
+                f'{name}: {message}' for name, messages in errors.items() for message in messages])
+        return Expense(**values), category
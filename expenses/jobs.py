@@ -0,0 +1,258 @@
+"""
+Background computation of the expensive reports.
+
+ReportJob rows are the queue and the result store at once: one row per
+report kind, normalized query string and data version (see
+expenses.caching). A view asks `latest()` for a report and gets the newest
+completed result right away, together with a flag telling whether it is
+out of date; if no job exists for the current data version, one is queued.
+`latest_many()` does the same for several reports in two queries.
+`run_worker()` (the `run_report_worker` command) claims pending jobs and
+computes them in a process pool, so a long report never holds up a request
+or the worker's own polling. No broker is involved: the database is the
+only shared state.
+
+Results are versioned against the data version the job was queued under.
+A write during the computation bumps the version, so the result is stored
+already stale and the next request queues a fresh job.
+"""
+import datetime
+import logging
+import multiprocessing
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable
+
+from django.db import connections
+from django.http import QueryDict
+from django.utils import timezone
+
+from . import caching
+from .forms import ExpenseSearchForm, TimeSeriesForm
+from .models import Expense, ReportJob
+from .pool import init_process
+from .reports import summary_per_category, summary_per_year_month
+from .timeseries import TimeSeries, time_series
+
+logger = logging.getLogger(__name__)
+
+PROCESSES = 2
+POLL_INTERVAL = 1.0
+# Finished jobs are kept this long after finishing, then pruned by the
+# worker; every distinct filter set otherwise leaves a row behind for good.
+RETENTION = datetime.timedelta(days=7)
+PRUNE_INTERVAL = 3600
+
+
+@dataclass
+class Report:
+    # (queryset, filters, query) -> value, run in the worker's processes.
+    compute: Callable
+    # value <-> JSON stored in ReportJob.result.
+    dump: Callable
+    load: Callable
+
+
+def _time_series(queryset, filters, query):
+    form = TimeSeriesForm(query)
+    granularity = form.cleaned_data['granularity'] if form.is_valid() else 'month'
+    return time_series(queryset, granularity, filters)
+
+
+REPORTS = {
+    'summary-per-category': Report(
+        lambda queryset, filters, query: summary_per_category(queryset, filters),
+        lambda summary: [[name, str(total)] for name, total in summary.items()],
+        lambda rows: OrderedDict((name, Decimal(total)) for name, total in rows),
+    ),
+    'summary-per-year-month': Report(
+        lambda queryset, filters, query: summary_per_year_month(queryset, filters),
+        lambda summary: [[period.isoformat(), str(total)] for period, total in summary.items()],
+        lambda rows: OrderedDict(
+            (datetime.date.fromisoformat(period), Decimal(total)) for period, total in rows),
+    ),
+    'timeseries': Report(_time_series, TimeSeries.as_dict, TimeSeries.from_dict),
+}
+
+
+def compute(kind, params):
+    """Compute report `kind` for the query string `params`; returns its JSON."""
+    query = QueryDict(params)
+    form = ExpenseSearchForm(query)
+    queryset, filters = Expense.objects.all(), {}
+    if form.is_valid():
+        queryset = form.order_queryset(form.filter_queryset(queryset))
+        filters = form.cleaned_data
+    report = REPORTS[kind]
+    return report.dump(report.compute(queryset, filters, query))
+
+
+def enqueue(kind, params, version=None):
+    if version is None:
+        version = caching.data_version()
+    # INSERT OR IGNORE: concurrent requests queue the same job only once.
+    ReportJob.objects.bulk_create(
+        [ReportJob(kind=kind, params=params, version=version)], ignore_conflicts=True)
+
+
+def latest(kind, params):
+    """
+    `(value, refreshing)` for report `kind` over the query string `params`:
+    the newest completed result (None if there is none yet) and whether a
+    computation for the current data is still pending. Up-to-date results
+    are cached like every other report.
+    """
+    return latest_many([kind], params)[kind]
+
+
+def latest_many(kinds, params):
+    """
+    `latest()` for several reports over the same `params`, as a dict by
+    kind, with one query for all of their jobs and one to queue the
+    missing ones.
+    """
+    for kind in kinds:
+        if kind not in REPORTS:
+            raise ValueError(f'Unknown report {kind!r}.')
+    version = caching.data_version()
+    cache = caching.get_cache()
+    keys = {kind: caching.make_key(f'job:{kind}', params, version) for kind in kinds}
+    cached = cache.get_many(keys.values())
+    results = {kind: (cached[key], False) for kind, key in keys.items() if key in cached}
+    missing = [kind for kind in kinds if kind not in results]
+    if not missing:
+        return results
+
+    jobs_of = {kind: [] for kind in missing}
+    for job in ReportJob.objects.filter(kind__in=missing, params=params).order_by('-version'):
+        jobs_of[job.kind].append(job)
+    queue = []
+    for kind, jobs in jobs_of.items():
+        load = REPORTS[kind].load
+        current = next((job for job in jobs if job.version == version), None)
+        done = next((job for job in jobs if job.status == ReportJob.DONE), None)
+        if current is None:
+            queue.append(kind)
+        elif current.status == ReportJob.DONE:
+            results[kind] = load(current.result), False
+            cache.set(keys[kind], results[kind][0])
+            continue
+        # A failed job is not retried until the data changes; serve what we have.
+        refreshing = current is None or current.status != ReportJob.FAILED
+        results[kind] = (load(done.result) if done else None), refreshing
+    if queue:
+        # INSERT OR IGNORE: concurrent requests queue the same job only once.
+        ReportJob.objects.bulk_create(
+            [ReportJob(kind=kind, params=params, version=version) for kind in queue],
+            ignore_conflicts=True)
+    return results
+
+
+def claim(limit):
+    """Mark up to `limit` of the oldest pending jobs running and return them."""
+    claimed = []
+    pending = ReportJob.objects.filter(status=ReportJob.PENDING).order_by('created_at', 'pk')
+    for job in pending.only('kind', 'params', 'version')[:limit * 2]:
+        if len(claimed) == limit:
+            break
+        newer = ReportJob.objects.filter(kind=job.kind, params=job.params, version__gt=job.version)
+        if newer.exists():
+            # Superseded before it started.
+            ReportJob.objects.filter(pk=job.pk, status=ReportJob.PENDING).delete()
+            continue
+        # Conditional, so a job is never claimed twice.
+        if ReportJob.objects.filter(pk=job.pk, status=ReportJob.PENDING).update(
+                status=ReportJob.RUNNING, started_at=timezone.now()):
+            claimed.append(job)
+    return claimed
+
+
+def finish(job, result=None, error=None):
+    ReportJob.objects.filter(pk=job.pk).update(
+        status=ReportJob.FAILED if error else ReportJob.DONE,
+        result=result, error=error or '', finished_at=timezone.now())
+    if error:
+        logger.error('Report %s?%s failed:\n%s', job.kind, job.params, error)
+    else:
+        # Older results of the same report are not served anymore.
+        ReportJob.objects.filter(
+            kind=job.kind, params=job.params, version__lt=job.version,
+        ).exclude(status=ReportJob.RUNNING).delete()
+
+
+def prune(retention=RETENTION):
+    """Delete jobs that finished more than `retention` ago; returns how many."""
+    cutoff = timezone.now() - retention
+    deleted, _ = ReportJob.objects.filter(
+        status__in=(ReportJob.DONE, ReportJob.FAILED), finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def _run(job, pool):
+    if pool is not None:
+        return pool.submit(compute, job.kind, job.params)
+    try:
+        finish(job, compute(job.kind, job.params))
+    except Exception:
+        finish(job, error=traceback.format_exc())
+
+
+def run_worker(processes=PROCESSES, poll=POLL_INTERVAL, once=False, log=None,
+               retention=RETENTION):
+    """
+    Compute queued reports until interrupted (or, with `once`, until the
+    queue is empty). `processes=0` computes them in this process instead of
+    a pool. Returns the number of jobs finished. Run one worker per
+    database: on start it queues again any job still marked running.
+    Every PRUNE_INTERVAL seconds, and on start, it deletes jobs finished
+    more than `retention` ago (never, with `retention=None`).
+    """
+    # Jobs left running by a worker that died are queued again.
+    ReportJob.objects.filter(status=ReportJob.RUNNING).update(
+        status=ReportJob.PENDING, started_at=None)
+    pool = None
+    if processes:
+        # Spawned, not forked: a forked SQLite connection is unsafe to use,
+        # so each process sets Django up again and opens its own.
+        pool = ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_process,
+            initargs=({alias: connections[alias].settings_dict['NAME'] for alias in connections},))
+    in_flight, finished, pruned_at = {}, 0, None
+    try:
+        while True:
+            if retention is not None and (
+                    pruned_at is None or time.monotonic() - pruned_at >= PRUNE_INTERVAL):
+                pruned = prune(retention)
+                pruned_at = time.monotonic()
+                if log and pruned:
+                    log(f'Pruned {pruned} finished reports.')
+            claimed = claim(max(processes, 1) - len(in_flight))
+            for job in claimed:
+                if log:
+                    log(f'Computing {job.kind}?{job.params} @{job.version}')
+                future = _run(job, pool)
+                if future is None:
+                    finished += 1
+                else:
+                    in_flight[future] = job
+            if in_flight:
+                done, _ = wait(in_flight, timeout=poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    try:
+                        finish(job, future.result())
+                    except Exception:
+                        finish(job, error=traceback.format_exc())
+                    finished += 1
+            elif not claimed:
+                if once:
+                    return finished
+                time.sleep(poll)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,72 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from expenses import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure request throughput under a mixed read/write load in a '
+        'separate SQLite database and write the results as JSON. Run it once '
+        'with the default settings and once with EXPENSES_DB_PROFILE=production '
+        'to compare the database profiles.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100_000,
+                            help='Number of expenses to load before measuring.')
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--readers', type=int, default=benchmark.READERS,
+                            help='Threads requesting list and report pages.')
+        parser.add_argument('--writers', type=int, default=benchmark.WRITERS,
+                            help='Threads creating expenses.')
+        parser.add_argument('--duration', type=float, default=benchmark.DURATION,
+                            help='Seconds to run the load for.')
+        parser.add_argument('--db-file', default='benchmark.sqlite3',
+                            help='SQLite file holding the generated data.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the database afterwards and reuse its rows next time.')
+        parser.add_argument('--output', default='-', help="JSON output file, or '-' for stdout.")
+        parser.add_argument('--compare', help='Earlier JSON output to compare against.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The benchmark runs against a SQLite database file.')
+        if options['readers'] < 0 or options['writers'] < 0 or options['duration'] <= 0:
+            raise CommandError('--readers and --writers must be >= 0, --duration > 0.')
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        with benchmark.benchmark_database(options['db_file'], options['keepdb']):
+            category_ids = benchmark.ensure_size(
+                options['size'], options['categories'], options['seed'], log=self.stderr.write)
+            self.stderr.write(
+                f"Running {options['readers']} readers and {options['writers']} writers "
+                f"for {options['duration']}s...")
+            results = benchmark.run_mixed(
+                category_ids, options['duration'], options['readers'], options['writers'],
+                options['seed'])
+            report = {
+                'meta': benchmark.metadata(
+                    size=options['size'], seed=options['seed'],
+                    categories=options['categories']),
+                'results': results,
+            }
+        output = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+
+        if baseline is not None:
+            for row in benchmark.compare_mixed(baseline, report):
+                self.stderr.write(
+                    f"{row['scenario']:<12} throughput x{row['throughput_ratio']}  "
+                    f"p50 x{row['p50_ratio']}  p95 x{row['p95_ratio']}  "
+                    f"errors {row['errors_delta']:+d}")
@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from expenses import benchmark
+
+
+def sizes(value):
+    try:
+        return sorted({int(size.replace('_', '')) for size in value.split(',') if size})
+    except ValueError:
+        raise CommandError(f'Invalid --sizes {value!r}; expected e.g. 10000,1000000.')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the expense pages at several data sizes in a separate '
+        'SQLite database and write the results as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=sizes,
+                            default=list(benchmark.SIZES),
+                            help='Comma-separated expense counts (default: 10000,1000000,10000000).')
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=benchmark.REPEAT,
+                            help='Timed requests per scenario.')
+        parser.add_argument('--warm', action='store_true',
+                            help='Keep the page cache between requests instead of clearing it.')
+        parser.add_argument('--db-file', default='benchmark.sqlite3',
+                            help='SQLite file holding the generated data.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the database afterwards and reuse its rows next time.')
+        parser.add_argument('--output', default='-', help="JSON output file, or '-' for stdout.")
+        parser.add_argument('--compare', help='Earlier JSON output to compare against.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The benchmark runs against a SQLite database file.')
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        with benchmark.benchmark_database(options['db_file'], options['keepdb']):
+            results = self.run(options)
+            report = {
+                'meta': benchmark.metadata(
+                    seed=options['seed'], categories=options['categories'],
+                    repeat=options['repeat'], warm=options['warm']),
+                'results': results,
+            }
+        output = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+
+        if baseline is not None:
+            for row in benchmark.compare(baseline, report):
+                self.stderr.write(
+                    f"{row['size']:>10} {row['scenario']:<20} "
+                    f"p50 x{row['p50_ratio']}  p95 x{row['p95_ratio']}  "
+                    f"queries {row['queries_delta']:+d}")
+
+    def run(self, options):
+        results = []
+        for size in options['sizes']:
+            category_ids = benchmark.ensure_size(
+                size, options['categories'], options['seed'], log=self.stderr.write)
+            self.stderr.write(f'Benchmarking {size} expenses...')
+            scenarios = benchmark.build_scenarios(category_ids[0] if category_ids else None)
+            results += benchmark.run(size, scenarios, options['repeat'], options['warm'])
+        return results
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import exporters
+from expenses.forms import SORT_CHOICES, ExpenseSearchForm
+from expenses.models import Category, Expense
+
+
+class Command(BaseCommand):
+    help = 'Stream expenses matching the list filters to a CSV or NDJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=exporters.FORMATS, default='csv')
+        parser.add_argument('--output', default='-', help="Output file, or '-' for stdout.")
+        parser.add_argument('--name', default='', help='Name search, as in the list view.')
+        parser.add_argument('--date-from', help='YYYY-MM-DD')
+        parser.add_argument('--date-to', help='YYYY-MM-DD')
+        parser.add_argument('--category', action='append', default=[],
+                            help='Category name; repeat for several.')
+        parser.add_argument('--sort', default='', choices=[value for value, _ in SORT_CHOICES])
+        parser.add_argument('--chunk-size', type=int, default=exporters.CHUNK_SIZE)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        queryset = Expense.objects.using(options['database'])
+        categories = dict(
+            Category.objects.using(options['database'])
+            .filter(name__in=options['category']).values_list('name', 'pk'))
+        unknown = set(options['category']) - set(categories)
+        if unknown:
+            raise CommandError(f'Unknown categories: {", ".join(sorted(unknown))}')
+
+        form = ExpenseSearchForm({
+            'name': options['name'],
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+            'categories': list(categories.values()),
+            'sort': options['sort'],
+        })
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        queryset = form.order_queryset(form.filter_queryset(queryset))
+
+        lines = exporters.export(queryset, options['format'], options['chunk_size'])
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+            f.writelines(lines)
@@ -0,0 +1,33 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from expenses import synthetic
+
+
+class Command(BaseCommand):
+    help = 'Seed deterministic synthetic categories and expenses for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--expenses', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--end-date', type=datetime.date.fromisoformat,
+                            default=synthetic.END_DATE,
+                            help='Last date to generate expenses on (YYYY-MM-DD).')
+        parser.add_argument('--days', type=int, default=synthetic.DAYS,
+                            help='Number of days the expenses are spread over.')
+        parser.add_argument('--batch-size', type=int, default=synthetic.BATCH_SIZE)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete all existing expenses and categories first.')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            synthetic.clear(options['database'])
+        synthetic.generate(
+            options['categories'], options['expenses'], seed=options['seed'],
+            end_date=options['end_date'], days=options['days'],
+            batch_size=options['batch_size'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['expenses']} expenses in {options['categories']} categories."))
@@ -0,0 +1,60 @@
+import csv
+import io
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.importers import FORMATS, ExpenseImporter, iter_rows
+
+
+class Command(BaseCommand):
+    help = 'Stream-import expenses from a CSV or JSON (array or NDJSON) file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for stdin.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Input format (default: from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk insert and transaction.')
+        parser.add_argument('--encoding', default='utf-8-sig',
+                            help='Input encoding (default: UTF-8, with or without a BOM).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate the input without writing anything.')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or Path(path).suffix.lstrip('.').lower()
+        if format in ('ndjson', 'jsonl'):
+            format = 'json'
+        if format not in FORMATS:
+            raise CommandError('Cannot tell the input format, pass --format.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        importer = ExpenseImporter(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            using=options['database'])
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding=options['encoding'], newline='')
+        else:
+            try:
+                stream = open(path, encoding=options['encoding'], newline='')
+            except OSError as e:
+                raise CommandError(e)
+        with stream:
+            try:
+                result = importer.run(iter_rows(stream, format))
+            except (ValueError, csv.Error) as e:
+                raise CommandError(f'Cannot parse input: {e}')
+
+        for number, message in result.errors:
+            self.stderr.write(f'row {number}: {message}')
+        if result.failed > len(result.errors):
+            self.stderr.write(f'... and {result.failed - len(result.errors)} more errors.')
+        verb = 'Would import' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {result.created} of {result.rows} rows '
+            f'({len(result.created_categories)} new categories, {result.failed} errors).'))
@@ -0,0 +1,100 @@
+import json
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.benchmark import percentile
+
+
+def summarize(records):
+    """
+    Per-endpoint latency breakdown of profiling records: request count,
+    p50/p95 of the total, and the mean time and share of the mean total of
+    each span and of SQL. Spans may nest (a summary inside the view), so
+    shares can add up to more than 100%.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault((record['view'], record['method']), []).append(record)
+
+    rows = []
+    for (view, method), group in groups.items():
+        totals = [record['total_ms'] for record in group]
+        mean = statistics.fmean(totals)
+        spans = {}
+        for record in group:
+            for name, ms in record['spans'].items():
+                spans[name] = spans.get(name, 0) + ms
+        db = [record['db_ms'] for record in group if record.get('db_ms') is not None]
+        if db:
+            spans['db'] = sum(db)
+        rows.append({
+            'view': view,
+            'method': method,
+            'requests': len(group),
+            'p50_ms': round(statistics.median(totals), 3),
+            'p95_ms': round(percentile(totals, 0.95), 3),
+            'mean_ms': round(mean, 3),
+            'spans': {
+                name: {
+                    'mean_ms': round(total / len(group), 3),
+                    'share': round(total / len(group) / mean, 3) if mean else None,
+                }
+                for name, total in sorted(spans.items(), key=lambda item: -item[1])
+            },
+        })
+    rows.sort(key=lambda row: -row['mean_ms'] * row['requests'])
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Summarize the request profiling log (settings.EXPENSES_PROFILE_LOG) '
+        'into per-endpoint latency breakdowns.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', nargs='?', help='JSON-lines log (default: EXPENSES_PROFILE_LOG).')
+        parser.add_argument('--view', action='append', default=[],
+                            help='Only this URL name, e.g. expenses:expense-list; repeatable.')
+        parser.add_argument('--since', help='Only requests at or after this ISO timestamp.')
+        parser.add_argument('--json', action='store_true', help='Print the summary as JSON.')
+
+    def handle(self, *args, **options):
+        path = options['log'] or getattr(settings, 'EXPENSES_PROFILE_LOG', None)
+        if not path:
+            raise CommandError('No log given and settings.EXPENSES_PROFILE_LOG is not set.')
+        records = []
+        try:
+            with open(path, encoding='utf-8') as f:
+                for number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        self.stderr.write(f'Skipping malformed line {number}.')
+                        continue
+                    if options['view'] and record['view'] not in options['view']:
+                        continue
+                    if options['since'] and record['time'] < options['since']:
+                        continue
+                    records.append(record)
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+
+        rows = summarize(records)
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        if not rows:
+            self.stdout.write('No requests recorded.')
+        for row in rows:
+            self.stdout.write(
+                f"{row['method']} {row['view']}: {row['requests']} requests, "
+                f"p50 {row['p50_ms']:.1f}ms, p95 {row['p95_ms']:.1f}ms, "
+                f"mean {row['mean_ms']:.1f}ms")
+            for name, span in row['spans'].items():
+                share = f"{span['share'] * 100:5.1f}%" if span['share'] is not None else '     -'
+                self.stdout.write(f"    {name:<24} {span['mean_ms']:>9.1f}ms {share}")
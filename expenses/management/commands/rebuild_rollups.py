@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from expenses.models import ExpenseRollup
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-category / per-month expense rollups from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default',
+                            help='Database to rebuild the rollups in.')
+
+    def handle(self, *args, **options):
+        count = ExpenseRollup.objects.db_manager(options['database']).rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} rollup rows.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over expense names.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default',
+                            help='Database to rebuild the index in.')
+
+    def handle(self, *args, **options):
+        if not search.is_supported(options['database']):
+            raise CommandError('Full-text search is only available on SQLite.')
+        search.rebuild_index(options['database'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt the expense search index.'))
@@ -0,0 +1,37 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute the reports queued by the views (EXPENSES_BACKGROUND_REPORTS) '
+        'in a process pool. Run one worker per database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=jobs.PROCESSES,
+                            help='Pool size; 0 computes in the worker process itself.')
+        parser.add_argument('--poll', type=float, default=jobs.POLL_INTERVAL,
+                            help='Seconds between looks at an empty queue.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty instead of waiting for jobs.')
+        parser.add_argument('--retention', type=float, default=jobs.RETENTION.days,
+                            help='Days to keep finished reports before pruning them; '
+                                 '0 keeps them forever.')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 0 or options['poll'] <= 0 or options['retention'] < 0:
+            raise CommandError('--processes and --retention must be >= 0 and --poll > 0.')
+        log = self.stderr.write if options['verbosity'] > 1 else None
+        retention = (datetime.timedelta(days=options['retention'])
+                     if options['retention'] else None)
+        try:
+            finished = jobs.run_worker(
+                options['processes'], options['poll'], options['once'], log=log,
+                retention=retention)
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(f'Finished {finished} reports.')
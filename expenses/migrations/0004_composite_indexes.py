@@ -0,0 +1,73 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:24
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Frozen copy of the full-text search DDL (see 0003_expense_fts).
+FTS_TABLE = 'expenses_expense_fts'
+
+CREATE_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, content='expenses_expense', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF id, name ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # Altering Expense fields rebuilds expenses_expense on SQLite, which
+    # drops the full-text search triggers along with the old table.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0003_expense_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_search_index),
+        migrations.AlterField(
+            model_name='expense',
+            name='category',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='expenses.category'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='date',
+            field=models.DateField(default=datetime.date.today),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['date', 'id', 'category', 'amount'], name='expense_date_id_cat_amount'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['category', 'date', 'id', 'amount'], name='expense_cat_date_id_amount'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['amount', 'id'], name='expense_amount_id'),
+        ),
+        migrations.AddIndex(
+            model_name='expenserollup',
+            index=models.Index(fields=['year', 'month', 'category', 'total'], name='rollup_period_total'),
+        ),
+        migrations.RunPython(create_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import expenses.models
+
+# Ranked searches join Expense to this view. The unary + makes the rowid
+# unusable as a join key into the FTS5 table, so SQLite runs the MATCH once
+# and probes expenses_expense by primary key, instead of driving from a
+# selective expense index and re-running the MATCH for every row it finds.
+CREATE_SQL = """CREATE VIEW IF NOT EXISTS expenses_expense_search AS
+    SELECT +rowid AS expense_id, name, rank FROM expenses_expense_fts"""
+DROP_SQL = 'DROP VIEW IF EXISTS expenses_expense_search'
+
+
+def create_view(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(CREATE_SQL)
+
+
+def drop_view(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseSearch',
+            fields=[
+                ('expense', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_hit', serialize=False, to='expenses.expense')),
+                ('name', expenses.models.FullTextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'expenses_expense_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_view, drop_view),
+    ]
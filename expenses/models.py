@@ -1,5 +1,113 @@
+import calendar
 import datetime
-from django.db import models
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.db import models, router, transaction
+from django.db.models import Count, F, Func, Lookup, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
+
+from . import caching
+
+ROLLUP_FIELDS = frozenset(('category', 'category_id', 'date', 'amount'))
+ROLLUP_BATCH_SIZE = 500
+
+# Set while a bulk operation maintains the rollups itself, so the nested
+# QuerySet.update() calls Django makes on its behalf don't do it again, or
+# inside rollups_deferred().
+_rollups_deferred = ContextVar('rollups_deferred', default=False)
+
+
+@contextmanager
+def rollups_deferred(using='default'):
+    """
+    Skip rollup maintenance in bulk_create/bulk_update/update inside the
+    block and rebuild the rollups once at the end. For large loads, where
+    one rebuild is cheaper than per-batch bucket updates.
+    """
+    token = _rollups_deferred.set(True)
+    try:
+        yield
+    finally:
+        _rollups_deferred.reset(token)
+    # Not on error: the load is rolled back or incomplete, and a rebuild
+    # would only hide the exception behind a long wait (or another error).
+    ExpenseRollup.objects.db_manager(using).rebuild()
+
+
+def _month_bounds(year, month):
+    # First and last day: the day after December 9999 is not a date.
+    start = datetime.date(year, month, 1)
+    end = start.replace(day=calendar.monthrange(year, month)[1])
+    return start, end
+
+
+class Quantized(Func):
+    """
+    A decimal expression rounded to its field's decimal places when read.
+    SQLite adds decimals as REAL, so sums would otherwise come back as e.g.
+    Decimal('4.40000000000000').
+    """
+    template = '%(expressions)s'
+
+    def convert_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return value.quantize(Decimal(1).scaleb(-self.output_field.decimal_places))
+
+
+def _batches(items, size=ROLLUP_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class InvalidatingQuerySet(models.QuerySet):
+    """
+    Invalidate cached expense pages on bulk writes, which don't send the
+    model signals the per-instance invalidation hangs off.
+    """
+
+    def bulk_create(self, *args, **kwargs):
+        objs = super().bulk_create(*args, **kwargs)
+        caching.invalidate(self.db)
+        return objs
+
+    def bulk_update(self, *args, **kwargs):
+        rows = super().bulk_update(*args, **kwargs)
+        caching.invalidate(self.db)
+        return rows
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        caching.invalidate(self.db)
+        return rows
+    update.alters_data = True
+
+
+class CategoryQuerySet(InvalidatingQuerySet):
+    def with_stats(self):
+        """
+        Annotate `expense_count`, `expense_total`, `first_date` and
+        `last_date`. Count and total are summed from the category's
+        ExpenseRollup months, the dates are seeks on the (category, date)
+        index. Each is a correlated subquery, so a page ordered by name
+        only computes them for the categories it shows.
+        """
+        rollups = ExpenseRollup.objects.filter(category=OuterRef('pk')).order_by().values('category')
+        expenses = Expense.objects.filter(category=OuterRef('pk')).values('date')
+        total_field = ExpenseRollup._meta.get_field('total')
+        return self.annotate(
+            expense_count=Coalesce(
+                Subquery(rollups.annotate(n=Sum('count')).values('n')), Value(0)),
+            expense_total=Quantized(Coalesce(
+                Subquery(rollups.annotate(s=Sum('total')).values('s'), output_field=total_field),
+                Value(Decimal(0)), output_field=total_field)),
+            first_date=Subquery(expenses.order_by('date')[:1]),
+            last_date=Subquery(expenses.order_by('-date')[:1]),
+        )
 
 
 class Category(models.Model):
@@ -8,20 +116,302 @@ class Category(models.Model):
 
     name = models.CharField(max_length=50, unique=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.name}'
 
 
+class ExpenseQuerySet(InvalidatingQuerySet):
+    """
+    Bulk operations that bypass model signals refresh the affected
+    ExpenseRollup buckets themselves.
+    """
+
+    def with_period(self):
+        return self.annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+
+    def rollup_keys(self):
+        return set(
+            self.with_period()
+            .order_by()
+            .values_list('category_id', 'year', 'month')
+            .distinct()
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if _rollups_deferred.get():
+            return super().bulk_create(objs, *args, **kwargs)
+        # Before self.db is read: the write and the rollup maintenance share
+        # one transaction on the writer, not the read alias.
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            if kwargs.get('update_conflicts'):
+                # Overwritten rows may have left other buckets; we don't know which.
+                ExpenseRollup.objects.db_manager(self.db).rebuild()
+            elif kwargs.get('ignore_conflicts'):
+                ExpenseRollup.objects.db_manager(self.db).refresh(
+                    obj.rollup_key for obj in objs)
+            else:
+                deltas = defaultdict(lambda: [Decimal(0), 0])
+                for obj in objs:
+                    delta = deltas[obj.rollup_key]
+                    delta[0] += obj.rollup_amount
+                    delta[1] += 1
+                ExpenseRollup.objects.db_manager(self.db).apply_deltas(deltas)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if _rollups_deferred.get() or not ROLLUP_FIELDS.intersection(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        objs = list(objs)
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            keys = set()
+            for batch in _batches(obj.pk for obj in objs):
+                keys |= self.model.objects.using(self.db).filter(pk__in=batch).rollup_keys()
+            token = _rollups_deferred.set(True)
+            try:
+                rows = super().bulk_update(objs, fields, *args, **kwargs)
+            finally:
+                _rollups_deferred.reset(token)
+            keys.update(obj.rollup_key for obj in objs)
+            ExpenseRollup.objects.db_manager(self.db).refresh(keys)
+        return rows
+
+    def update(self, **kwargs):
+        if _rollups_deferred.get() or not ROLLUP_FIELDS.intersection(kwargs):
+            return super().update(**kwargs)
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            keys = self.rollup_keys()
+            moved = self._moved_rollup_keys(keys, kwargs)
+            rows = super().update(**kwargs)
+            if moved is None:
+                ExpenseRollup.objects.db_manager(self.db).rebuild()
+            else:
+                ExpenseRollup.objects.db_manager(self.db).refresh(keys | moved)
+        return rows
+    update.alters_data = True
+
+    def _moved_rollup_keys(self, keys, values):
+        """
+        Buckets that rows in `keys` end up in after `update(**values)`, or
+        None when they can't be known up front (expressions).
+        """
+        category = values.get('category_id', values.get('category', F('category_id')))
+        date = values.get('date', F('date'))
+        if isinstance(category, Category):
+            category = category.pk
+        moves_category = not hasattr(category, 'resolve_expression')
+        moves_date = not hasattr(date, 'resolve_expression')
+        if ('category' in values or 'category_id' in values) and not moves_category:
+            return None
+        if 'date' in values and not moves_date:
+            return None
+        if moves_date:
+            date = self.model._meta.get_field('date').to_python(date)
+        return {
+            (category if moves_category else category_id,
+             date.year if moves_date else year,
+             date.month if moves_date else month)
+            for category_id, year, month in keys
+        }
+
+
 class Expense(models.Model):
     class Meta:
         ordering = ('-date', '-pk')
+        indexes = [
+            # Listing by date (the id tiebreak included), date ranges and
+            # per-day totals, all without touching the table.
+            models.Index(fields=('date', 'id', 'category', 'amount'),
+                         name='expense_date_id_cat_amount'),
+            # Category filters, per-category totals and the FK itself.
+            models.Index(fields=('category', 'date', 'id', 'amount'),
+                         name='expense_cat_date_id_amount'),
+            # Listing by amount.
+            models.Index(fields=('amount', 'id'), name='expense_amount_id'),
+        ]
 
-    category = models.ForeignKey(Category, models.PROTECT, null=True, blank=True)
+    category = models.ForeignKey(Category, models.PROTECT, null=True, blank=True,
+                                 db_index=False)
 
     name = models.CharField(max_length=50)
     amount = models.DecimalField(max_digits=8, decimal_places=2)
 
-    date = models.DateField(default=datetime.date.today, db_index=True)
+    date = models.DateField(default=datetime.date.today)
+
+    objects = ExpenseQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.date} {self.name} {self.amount}'
+
+    def save(self, *args, **kwargs):
+        # Rollup maintenance runs in pre/post_save, keep it in one transaction.
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+    @property
+    def rollup_key(self):
+        date = self._meta.get_field('date').to_python(self.date)
+        return self.category_id, date.year, date.month
+
+    @property
+    def rollup_amount(self):
+        return self._meta.get_field('amount').to_python(self.amount)
+
+
+class Match(Lookup):
+    """`field__match=query`: an SQLite full-text MATCH against an FTS5 column."""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class FullTextField(models.TextField):
+    pass
+
+
+FullTextField.register_lookup(Match)
+
+
+class ExpenseSearch(models.Model):
+    """
+    The full-text index of Expense.name (see expenses.search), through the
+    `expenses_expense_search` view over the FTS5 table that migration 0006
+    creates on SQLite. `rank` is only defined in queries that MATCH `name`.
+    """
+
+    class Meta:
+        managed = False
+        db_table = 'expenses_expense_search'
+
+    expense = models.OneToOneField(Expense, models.DO_NOTHING, primary_key=True,
+                                   db_constraint=False, related_name='search_hit')
+    name = FullTextField()
+    rank = models.FloatField()
+
+
+class ExpenseRollupManager(models.Manager):
+    @property
+    def write_db(self):
+        # Maintenance reads Expense on the alias it writes to, in the same
+        # transaction; `db` would route those reads to the read alias.
+        return self._db or router.db_for_write(self.model, **self._hints)
+
+    def apply_deltas(self, deltas):
+        """
+        Add `{(category_id, year, month): (amount, count)}` deltas to the
+        matching buckets, creating and dropping rows as needed.
+        """
+        for (category_id, year, month), (amount, count) in deltas.items():
+            if not amount and not count:
+                continue
+            bucket = self.filter(category_id=category_id, year=year, month=month)
+            updated = bucket.update(total=F('total') + amount, count=F('count') + count)
+            if not updated:
+                self.create(category_id=category_id, year=year, month=month,
+                            total=amount, count=count)
+            elif count < 0:
+                bucket.filter(count__lte=0).delete()
+
+    def refresh(self, keys):
+        """Recompute the given `(category_id, year, month)` buckets from Expense."""
+        using = self.write_db
+        rollups, expenses = self.db_manager(using), Expense.objects.using(using)
+        for batch in _batches(set(keys)):
+            live, stored = Q(), Q()
+            for category_id, year, month in batch:
+                start, end = _month_bounds(year, month)
+                live |= Q(category_id=category_id, date__gte=start, date__lte=end)
+                stored |= Q(category_id=category_id, year=year, month=month)
+            rollups.filter(stored).delete()
+            rollups.bulk_create(self._aggregate(expenses.filter(live)))
+
+    def rebuild(self):
+        """Drop every bucket and recompute them from Expense. Returns bucket count."""
+        using = self.write_db
+        rollups = self.db_manager(using)
+        with transaction.atomic(using=using):
+            rollups.all().delete()
+            rows = self._aggregate(Expense.objects.using(using).all())
+            return len(rollups.bulk_create(rows, batch_size=ROLLUP_BATCH_SIZE))
+
+    def _aggregate(self, queryset):
+        return [
+            self.model(**row) for row in
+            queryset.with_period()
+            .order_by()
+            .values('category_id', 'year', 'month')
+            .annotate(total=Sum('amount'), count=Count('pk'))
+        ]
+
+
+class ExpenseRollup(models.Model):
+    """Expense totals per category and calendar month, kept in sync with Expense."""
+
+    class Meta:
+        ordering = ('-year', '-month')
+        indexes = [
+            # Per-month totals over period ranges.
+            models.Index(fields=('year', 'month', 'category', 'total'),
+                         name='rollup_period_total'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=('category', 'year', 'month'),
+                                    name='expenses_rollup_bucket'),
+        ]
+
+    category = models.ForeignKey(Category, models.CASCADE, null=True, blank=True)
+
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = ExpenseRollupManager()
+
+    def __str__(self):
+        return f'{self.year}-{self.month:02} {self.category or "-"} {self.total}'
+
+
+class ReportJob(models.Model):
+    """
+    A report computed in the background (see expenses.jobs): one row per
+    report, query string and data version, holding the result once done.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(status, status) for status in (PENDING, RUNNING, DONE, FAILED)]
+
+    class Meta:
+        indexes = [
+            # The worker's queue: oldest pending job first.
+            models.Index(fields=('status', 'created_at'), name='report_job_queue'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=('kind', 'params', 'version'),
+                                    name='expenses_report_job'),
+        ]
+
+    kind = models.CharField(max_length=50)
+    params = models.TextField(blank=True)
+    version = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.kind}?{self.params} @{self.version} {self.status}'
@@ -0,0 +1,165 @@
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .caching import cached_count
+from .profiling import span
+
+CURSOR_SALT = 'expenses.pagination.cursor'
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator whose `COUNT(*)` is cached per queryset until the next write."""
+
+    @cached_property
+    @span('count')
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            return cached_count(self.object_list)
+        return super().count
+
+
+class KeysetPaginator:
+    """
+    Seek-method paginator over a queryset ordered by `(<key>, pk)`.
+
+    Pages are addressed by opaque signed cursors holding the boundary row's
+    key and pk, so fetching any page is an index seek plus `LIMIT`, no matter
+    how deep. The total is a `COUNT(*)` cached per filter set until the
+    next write or for `EXPENSES_PAGINATION_COUNT_TIMEOUT` seconds.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.key, self.descending = self._parse_ordering(queryset)
+
+    @staticmethod
+    def _parse_ordering(queryset):
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        if len(ordering) != 2 or not all(isinstance(field, str) for field in ordering):
+            raise ValueError(f'Keyset pagination needs a (<key>, pk) ordering, got {ordering!r}.')
+        key, tiebreak = ordering
+        descending = key.startswith('-')
+        if tiebreak.lstrip('-') not in ('pk', 'id') or tiebreak.startswith('-') != descending:
+            raise ValueError(f'Keyset pagination needs a (<key>, pk) ordering, got {ordering!r}.')
+        return key.lstrip('-'), descending
+
+    @cached_property
+    @span('count')
+    def count(self):
+        return cached_count(
+            self.queryset, getattr(settings, 'EXPENSES_PAGINATION_COUNT_TIMEOUT', 60))
+
+    def encode_cursor(self, obj, index, direction):
+        value = getattr(obj, self.key)
+        if value is not None and not isinstance(value, (str, int, float)):
+            value = str(value)
+        return signing.dumps(
+            {'k': self.key, 'v': value, 'pk': obj.pk, 'i': index, 'd': direction},
+            salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, cursor):
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise InvalidPage('Invalid cursor.')
+        if data.get('k') != self.key or data.get('d') not in ('next', 'prev'):
+            raise InvalidPage('Cursor does not match the current ordering.')
+        try:
+            field = self.queryset.model._meta.get_field(self.key)
+        except FieldDoesNotExist:
+            value = data['v']
+        else:
+            value = field.to_python(data['v'])
+        return value, data['pk'], data['i'], data['d']
+
+    def page(self, cursor=None):
+        queryset, index, forward, has_other = self._seek(cursor)
+        return self._page(list(queryset[:self.per_page + 1]), index, forward, has_other)
+
+    async def apage(self, cursor=None):
+        queryset, index, forward, has_other = self._seek(cursor)
+        rows = [obj async for obj in queryset[:self.per_page + 1].aiterator()]
+        return self._page(rows, index, forward, has_other)
+
+    def _seek(self, cursor):
+        """The queryset holding the page after (or before) `cursor`, and where it starts."""
+        if not cursor:
+            return self.queryset, 0, True, False
+        value, pk, index, direction = self.decode_cursor(cursor)
+        forward = direction == 'next'
+        # Seeking forward against a descending key means "smaller than the
+        # boundary row"; seeking backwards flips both comparison and ordering.
+        lookup = 'lt' if forward == self.descending else 'gt'
+        queryset = self.queryset.filter(
+            Q(**{f'{self.key}__{lookup}': value})
+            | Q(**{self.key: value, f'pk__{lookup}': pk}))
+        if not forward:
+            queryset = queryset.reverse()
+            index = max(index - self.per_page, 0)
+        return queryset, index, forward, True
+
+    def _page(self, rows, index, forward, has_other):
+        if not rows:
+            # A stale cursor (the rows past it were deleted): nothing further
+            # that way, but the page was reached from somewhere.
+            return KeysetPage(rows, self, index, has_next=False, has_previous=has_other)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        return KeysetPage(
+            rows, self, index,
+            has_next=has_more if forward else has_other,
+            has_previous=has_other if forward else has_more)
+
+
+class KeysetPage:
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, index, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.index = index
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<Keyset page at {self.start_index()}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def start_index(self):
+        return self.index + 1 if self.object_list else 0
+
+    def end_index(self):
+        return self.index + len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(
+                self.object_list[-1], self.end_index(), 'next')
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(
+                self.object_list[0], self.index, 'prev')
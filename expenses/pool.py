@@ -0,0 +1,15 @@
+"""
+Setup of the report worker's pool processes (see expenses.jobs).
+
+Kept apart from expenses.jobs because a spawned process imports the
+initializer's module before Django is set up, and jobs imports models.
+"""
+import django
+from django.db import connections
+
+
+def init_process(names):
+    """Set Django up in a fresh process, on the database files `names` maps aliases to."""
+    django.setup()
+    for alias, name in names.items():
+        connections[alias].settings_dict['NAME'] = name
@@ -0,0 +1,194 @@
+"""
+Request profiling: timing spans, a Server-Timing header and cProfile dumps.
+
+Code marks its phases with `span('name')`, as a context manager or as a
+decorator (sync or async). Spans only record while ProfilingMiddleware has
+a trace open for the current request, so outside a request they cost a
+ContextVar lookup. For each request the middleware
+
+- adds a `Server-Timing` header with the summed duration of each span,
+  the SQL time counted by QueryBudgetMiddleware (`db`) and the total,
+  when `settings.EXPENSES_SERVER_TIMING` is set (default: DEBUG);
+- appends one JSON line per request to `settings.EXPENSES_PROFILE_LOG`,
+  if set, for the `profile_report` command to summarize;
+- profiles a `settings.EXPENSES_PROFILE_SAMPLE_RATE` fraction of sync
+  requests with cProfile and keeps the pstats file in
+  `settings.EXPENSES_PROFILE_DIR` when the request took longer than
+  `settings.EXPENSES_PROFILE_SLOW_MS`.
+
+Template rendering happens after the view returns; the middleware times it
+as the `render` span through the TemplateResponse hooks.
+"""
+import cProfile
+import datetime
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# The Trace of the request being handled in the current context.
+_trace = ContextVar('profiling_trace', default=None)
+_log_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, seconds):
+        self.spans.append((name, seconds))
+
+    def totals(self):
+        """Milliseconds per span name, in order of first occurrence."""
+        totals = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0) + seconds * 1000
+        return totals
+
+
+class span:
+    """Time a block, or every call of a function, as the span `name`."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(self.name, elapsed)
+
+    def __call__(self, func):
+        if iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(self.name):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(self.name):
+                    return func(*args, **kwargs)
+        return wrapper
+
+
+def server_timing(trace, total, db=None):
+    metrics = [f'{name};dur={ms:.1f}' for name, ms in trace.totals().items()]
+    if db is not None:
+        metrics.append(f'db;dur={db * 1000:.1f}')
+    metrics.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(metrics)
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else request.path
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace = Trace()
+        token = _trace.set(trace)
+        profiler = self.start_profiler()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler:
+                profiler.disable()
+            _trace.reset(token)
+        self.finish(request, response, trace, profiler)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile only sees the calling thread, not the sync_to_async
+        # workers an async view queries through; spans still cover both.
+        trace = Trace()
+        token = _trace.set(trace)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _trace.reset(token)
+        self.finish(request, response, trace)
+        return response
+
+    def process_template_response(self, request, response):
+        trace, start = _trace.get(), time.perf_counter()
+        if trace is not None:
+            response.add_post_render_callback(
+                lambda response: trace.add('render', time.perf_counter() - start))
+        return response
+
+    @staticmethod
+    def start_profiler():
+        rate = getattr(settings, 'EXPENSES_PROFILE_SAMPLE_RATE', 0)
+        if not rate or random.random() >= rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active in this thread
+            return None
+        return profiler
+
+    def finish(self, request, response, trace, profiler=None):
+        total = time.perf_counter() - trace.start
+        stats = getattr(request, 'query_stats', None)
+        if getattr(settings, 'EXPENSES_SERVER_TIMING', settings.DEBUG):
+            response['Server-Timing'] = server_timing(trace, total, stats and stats.time)
+        record = {
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'view': get_view_name(request),
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 3),
+            'db_ms': round(stats.time * 1000, 3) if stats else None,
+            'queries': stats.count if stats else None,
+            'spans': {name: round(ms, 3) for name, ms in trace.totals().items()},
+        }
+        if profiler and total * 1000 >= getattr(settings, 'EXPENSES_PROFILE_SLOW_MS', 0):
+            record['profile'] = self.dump_profile(profiler, record)
+        self.log(record)
+
+    @staticmethod
+    def dump_profile(profiler, record):
+        directory = getattr(settings, 'EXPENSES_PROFILE_DIR', 'profiles')
+        os.makedirs(directory, exist_ok=True)
+        name = record['view'].replace(':', '-').strip('/').replace('/', '-') or 'root'
+        path = os.path.join(directory, f'{time.time_ns()}-{name}.pstats')
+        profiler.dump_stats(path)
+        logger.info('%s took %.1fms, profile written to %s', record['view'], record['total_ms'], path)
+        return path
+
+    @staticmethod
+    def log(record):
+        path = getattr(settings, 'EXPENSES_PROFILE_LOG', None)
+        if not path:
+            return
+        line = json.dumps(record) + '\n'
+        with _log_lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
@@ -0,0 +1,157 @@
+"""
+Per-request SQL query budgets.
+
+Views declare a budget with a `query_budget` attribute (number of queries)
+or through `settings.QUERY_BUDGETS`, keyed by namespaced URL name. The
+middleware counts and times every query a request runs, stores the result
+on `request.query_stats` and logs a warning (or raises QueryBudgetExceeded
+when `settings.QUERY_BUDGET_RAISE` is set) when a view goes over budget.
+"""
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+# The QueryStats collecting in the current context. Concurrent async
+# requests share the connections of sync_to_async's thread, so a wrapper
+# installed by one of them also sees the others' queries; it only counts
+# the ones run on behalf of its own context.
+_collecting = ContextVar('query_stats_collecting', default=frozenset())
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if self not in _collecting.get():
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.time += elapsed
+            self.queries.append((sql, elapsed))
+
+    def __str__(self):
+        return f'{self.count} queries in {self.time * 1000:.1f}ms'
+
+
+@contextmanager
+def _execute_wrapper(connection, wrapper):
+    # connection.execute_wrapper() pops the last wrapper on exit, which is
+    # another request's when async requests sharing the thread's connection
+    # overlap; remove this one by identity instead.
+    connection.execute_wrappers.append(wrapper)
+    try:
+        yield
+    finally:
+        connection.execute_wrappers.remove(wrapper)
+
+
+@contextmanager
+def count_queries(using=None):
+    """Count and time the queries run inside the block on `using` (default: all)."""
+    stats = QueryStats()
+    aliases = [using] if using else connections
+    # Not reset(token): the async middleware enters and exits this in
+    # different sync_to_async calls, i.e. different copies of the context.
+    collecting = _collecting.get()
+    _collecting.set(collecting | {stats})
+    try:
+        with ExitStack() as stack:
+            for alias in aliases:
+                stack.enter_context(_execute_wrapper(connections[alias], stats))
+            yield stats
+    finally:
+        _collecting.set(collecting)
+
+
+def check_budget(stats, max_queries, max_time=None, label='block'):
+    """Return a description of how `stats` exceed the budget, or None."""
+    problems = []
+    if max_queries is not None and stats.count > max_queries:
+        problems.append(f'{stats.count} queries (budget {max_queries})')
+    if max_time is not None and stats.time > max_time:
+        problems.append(f'{stats.time * 1000:.1f}ms in SQL (budget {max_time * 1000:.1f}ms)')
+    if problems:
+        queries = '\n'.join(f'  {i}. {sql}' for i, (sql, _) in enumerate(stats.queries, 1))
+        return f'{label} exceeded its query budget: {", ".join(problems)}\n{queries}'
+
+
+def get_view_budget(request):
+    match = request.resolver_match
+    if match is None:
+        return None
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    if match.view_name in budgets:
+        return budgets[match.view_name]
+    view_class = getattr(match.func, 'view_class', None)
+    return getattr(view_class, 'query_budget', None)
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with count_queries() as stats:
+            response = self.get_response(request)
+        self.check(request, stats)
+        return response
+
+    async def __acall__(self, request):
+        # Async views run their queries in sync_to_async's shared thread,
+        # on connections of that thread; hook the counter in there.
+        stack = ExitStack()
+        stats = await sync_to_async(stack.enter_context)(count_queries())
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.check(request, stats)
+        return response
+
+    def check(self, request, stats):
+        request.query_stats = stats
+        budget = get_view_budget(request)
+        if budget is not None:
+            message = check_budget(stats, budget, label=request.resolver_match.view_name)
+            if message:
+                if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+
+
+class QueryBudgetTestMixin:
+    """TestCase mixin asserting that a block stays within a query budget."""
+
+    @contextmanager
+    def assertQueryBudget(self, max_queries, max_time=None, using=None):
+        with count_queries(using) as stats:
+            yield stats
+        message = check_budget(stats, max_queries, max_time)
+        if message:
+            self.fail(message)
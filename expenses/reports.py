@@ -1,16 +1,123 @@
+import calendar
+import datetime
 from collections import OrderedDict
 
-from django.db.models import Sum, Value
-from django.db.models.functions import Coalesce
+from django.db.models import Q, Sum
 
+from .models import Category, ExpenseRollup, Quantized
+from .profiling import span
 
-def summary_per_category(queryset):
-    return OrderedDict(sorted(
+
+def rollup_lookups(filters):
+    """
+    Translate ExpenseSearchForm cleaned data into ExpenseRollup lookups.
+
+    Returns None when the rollup can't answer the filters exactly (name
+    search, date bounds that split a month) or when no filters are given.
+    """
+    if filters is None or filters.get('name', '').strip():
+        return None
+
+    lookups = Q()
+    date_from, date_to = filters.get('date_from'), filters.get('date_to')
+    if date_from:
+        if date_from.day != 1:
+            return None
+        lookups &= (Q(year__gt=date_from.year)
+                    | Q(year=date_from.year, month__gte=date_from.month))
+    if date_to:
+        if calendar.monthrange(date_to.year, date_to.month)[1] != date_to.day:
+            return None
+        lookups &= (Q(year__lt=date_to.year)
+                    | Q(year=date_to.year, month__lte=date_to.month))
+    if filters.get('categories'):
+        lookups &= Q(category__in=list(filters['categories']))
+    return lookups
+
+
+def _category_totals(queryset, filters):
+    lookups = rollup_lookups(filters)
+    amount = 'amount'
+    if lookups is not None:
+        queryset, amount = ExpenseRollup.objects.filter(lookups), 'total'
+
+    # Group on the indexed category_id and look the few names up afterwards;
+    # grouping on the joined name would sort every row in a temp B-tree.
+    return (
+        queryset
+        .order_by()
+        .values('category_id')
+        .annotate(s=Quantized(Sum(amount)))
+        .values_list('category_id', 's')
+    )
+
+
+def _category_names(totals):
+    return (
+        Category.objects
+        .filter(pk__in=[pk for pk in totals if pk is not None])
+        .order_by()
+        .values_list('pk', 'name')
+    )
+
+
+def _fold_categories(totals, names):
+    summary = {}
+    for pk, total in totals.items():
+        name = names.get(pk, '-')
+        summary[name] = summary.get(name, 0) + total
+    return OrderedDict(sorted(summary.items()))
+
+
+@span('summary_per_category')
+def summary_per_category(queryset, filters=None):
+    totals = dict(_category_totals(queryset, filters))
+    return _fold_categories(totals, dict(_category_names(totals)))
+
+
+@span('summary_per_category')
+async def asummary_per_category(queryset, filters=None):
+    totals = {pk: total async for pk, total in _category_totals(queryset, filters)}
+    names = {pk: name async for pk, name in _category_names(totals)}
+    return _fold_categories(totals, names)
+
+
+def _year_month_totals(queryset, filters):
+    """`(year, month, total)` rows, or `(date, total)` when aggregated live."""
+    lookups = rollup_lookups(filters)
+    if lookups is not None:
+        return (
+            ExpenseRollup.objects.filter(lookups)
+            .order_by()
+            .values('year', 'month')
+            .annotate(s=Quantized(Sum('total')))
+            .values_list('year', 'month', 's')
+        )
+    # Per-day totals come straight off the date index; months are folded
+    # in Python instead of grouping on an extracted expression.
+    return (
         queryset
-        .annotate(category_name=Coalesce('category__name', Value('-')))
         .order_by()
-        .values('category_name')
-        .annotate(s=Sum('amount'))
-        .values_list('category_name', 's')
-    ))
+        .values('date')
+        .annotate(s=Quantized(Sum('amount')))
+        .values_list('date', 's')
+    )
+
+
+def _fold_months(rows):
+    summary = {}
+    for *key, total in rows:
+        year, month = (key[0].year, key[0].month) if len(key) == 1 else key
+        period = datetime.date(year, month, 1)
+        summary[period] = summary.get(period, 0) + total
+    return OrderedDict(sorted(summary.items()))
+
+
+@span('summary_per_year_month')
+def summary_per_year_month(queryset, filters=None):
+    return _fold_months(_year_month_totals(queryset, filters))
+
 
+@span('summary_per_year_month')
+async def asummary_per_year_month(queryset, filters=None):
+    return _fold_months([row async for row in _year_month_totals(queryset, filters)])
@@ -0,0 +1,47 @@
+"""
+Read/write splitting for the SQLite production profile.
+
+Reads of expense data (the list pages, reports and API) go to the
+read-only alias named by `settings.EXPENSES_READ_DATABASE`; every write,
+and every read inside a transaction on the writer, goes to the default
+alias. Both aliases open the same file, and in WAL mode readers never wait
+for the writer, so reads see everything committed so far. Without a read
+alias configured the router stays out of the way.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+APP_LABEL = 'expenses'
+
+
+def get_read_alias():
+    alias = getattr(settings, 'EXPENSES_READ_DATABASE', None)
+    return alias if alias in settings.DATABASES else None
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        reader = get_read_alias()
+        if reader is None or model._meta.app_label != APP_LABEL:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        # Inside atomic() the writer's uncommitted rows must stay visible.
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return reader
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS if get_read_alias() else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        reader = get_read_alias()
+        if reader and {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, reader}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if get_read_alias() == db:
+            return False
+        return None
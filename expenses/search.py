@@ -0,0 +1,58 @@
+"""
+Full-text search over Expense.name.
+
+On SQLite the names are indexed in the FTS5 table `expenses_expense_fts`,
+an external-content index over `expenses_expense` that database triggers
+keep in sync on every insert, update and delete (including bulk ones).
+The table and triggers are created by migrations (0003_expense_fts), as
+is the `expenses_expense_search` view that ranked searches join through
+(ExpenseSearch, 0006_expense_search_view).
+Other backends fall back to `name__icontains`.
+"""
+import re
+
+from django.db import connections
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'expenses_expense_fts'
+
+MATCH_SQL = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+
+
+def is_supported(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 query matching every term as a prefix, e.g.
+    `coffee bea` -> `"coffee"* AND "bea"*`. Returns None when `text` has no
+    indexable terms.
+    """
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    return ' AND '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def search(queryset, text, ranked=False):
+    """
+    Filter `queryset` down to expenses whose name matches `text`. With
+    `ranked`, annotate `search_rank` (lower is more relevant).
+    """
+    match = build_match_query(text)
+    if match is None or not is_supported(queryset.db):
+        return queryset.filter(name__icontains=text.strip())
+    if ranked:
+        # Through the ExpenseSearch view, joined once rather than ranked per row.
+        return queryset.filter(search_hit__name__match=match).annotate(
+            search_rank=F('search_hit__rank'))
+    return queryset.filter(pk__in=RawSQL(MATCH_SQL, [match]))
+
+
+def rebuild_index(using='default'):
+    """Repopulate the FTS index from expenses_expense and merge its segments."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import caching
+from .models import Category, Expense, ExpenseRollup
+
+
+@receiver(pre_save, sender=Expense)
+def remember_rollup_bucket(sender, instance, using, **kwargs):
+    instance._rollup_previous = None
+    if instance.pk is not None:
+        instance._rollup_previous = (
+            Expense.objects.using(using)
+            .filter(pk=instance.pk)
+            .order_by()
+            .values_list('category_id', 'date', 'amount')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Expense)
+def update_rollup_on_save(sender, instance, using, **kwargs):
+    deltas = {instance.rollup_key: [instance.rollup_amount, 1]}
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous is not None:
+        category_id, date, amount = previous
+        delta = deltas.setdefault((category_id, date.year, date.month), [0, 0])
+        delta[0] -= amount
+        delta[1] -= 1
+    ExpenseRollup.objects.db_manager(using).apply_deltas(deltas)
+
+
+@receiver(post_delete, sender=Expense)
+def update_rollup_on_delete(sender, instance, using, **kwargs):
+    ExpenseRollup.objects.db_manager(using).apply_deltas(
+        {instance.rollup_key: (-instance.rollup_amount, -1)})
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Category)
+def invalidate_cache(sender, using, **kwargs):
+    caching.invalidate(using)
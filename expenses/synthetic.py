@@ -0,0 +1,113 @@
+"""
+Deterministic synthetic expenses for load testing.
+
+The same seed and arguments always produce the same rows. Category
+popularity follows a Zipf-like curve (a few categories hold most expenses),
+amounts are log-normal (many small purchases, a long tail of large ones)
+and dates are spread evenly over the span with a weekend bump. Rows are
+written with `bulk_create` in batches and the rollups are rebuilt once at
+the end instead of per batch.
+"""
+import datetime
+import itertools
+import math
+import random
+from bisect import bisect
+from decimal import Decimal
+
+from django.db import connections, transaction
+
+from . import caching
+from .models import Category, Expense, ExpenseRollup, rollups_deferred
+
+BATCH_SIZE = 5000
+END_DATE = datetime.date(2024, 12, 31)
+DAYS = 5 * 365
+MAX_AMOUNT = Decimal('999999.99')
+
+WORDS = (
+    'bread', 'milk', 'coffee', 'lunch', 'dinner', 'taxi', 'bus', 'train',
+    'fuel', 'parking', 'rent', 'power', 'water', 'internet', 'phone', 'gym',
+    'cinema', 'books', 'shoes', 'shirt', 'gift', 'pharmacy', 'doctor',
+    'insurance', 'hotel', 'flight', 'groceries', 'snacks', 'repair', 'tools',
+)
+CATEGORY_WORDS = (
+    'food', 'transport', 'housing', 'utilities', 'health', 'leisure',
+    'clothing', 'travel', 'education', 'gifts', 'household', 'services',
+)
+
+
+def category_names(count):
+    """`count` distinct category names that fit Category.name."""
+    names = []
+    for i in range(count):
+        word = CATEGORY_WORDS[i % len(CATEGORY_WORDS)]
+        names.append(word if i < len(CATEGORY_WORDS) else f'{word}-{i // len(CATEGORY_WORDS)}')
+    return names
+
+
+def category_weights(count, exponent=1.1):
+    """Cumulative Zipf weights for `count` categories, most popular first."""
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def iter_expenses(count, category_ids, seed=0, end_date=END_DATE, days=DAYS):
+    """
+    Yield `count` unsaved Expense instances spread over `category_ids`.
+    An empty `category_ids` gives uncategorized expenses.
+    """
+    rng = random.Random(seed)
+    cumulative = category_weights(len(category_ids))
+    start = end_date - datetime.timedelta(days=days - 1)
+    cents = Decimal('0.01')
+
+    for _ in range(count):
+        day = rng.randrange(days)
+        # Weekends get a few more purchases than weekdays.
+        if (start + datetime.timedelta(days=day)).weekday() < 5 and rng.random() < 0.15:
+            day = rng.randrange(days)
+        category_id = None
+        if category_ids:
+            category_id = category_ids[bisect(cumulative, rng.random() * cumulative[-1])
+                                       if len(category_ids) > 1 else 0]
+        amount = Decimal(math.exp(rng.gauss(3.0, 1.2))).quantize(cents)
+        yield Expense(
+            name=f'{rng.choice(WORDS)} {rng.choice(WORDS)}',
+            amount=min(max(amount, cents), MAX_AMOUNT),
+            date=start + datetime.timedelta(days=day),
+            category_id=category_id,
+        )
+
+
+def generate(categories, expenses, seed=0, end_date=END_DATE, days=DAYS,
+             batch_size=BATCH_SIZE, using='default'):
+    """
+    Create `categories` categories (reusing ones with the same names) and
+    `expenses` expenses. Returns the category ids.
+    """
+    names = category_names(categories)
+    Category.objects.using(using).bulk_create(
+        [Category(name=name) for name in names], ignore_conflicts=True,
+        batch_size=batch_size)
+    ids = dict(Category.objects.using(using).filter(name__in=names).values_list('name', 'pk'))
+    category_ids = [ids[name] for name in names]
+
+    if not expenses:
+        return category_ids
+    rows = iter_expenses(expenses, category_ids, seed, end_date, days)
+    with rollups_deferred(using):
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            with transaction.atomic(using=using):
+                Expense.objects.using(using).bulk_create(batch)
+    return category_ids
+
+
+def clear(using='default'):
+    """Delete every expense and category, bypassing per-row signals."""
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        for model in (ExpenseRollup, Expense, Category):
+            cursor.execute(f'DELETE FROM {connections[using].ops.quote_name(model._meta.db_table)}')
+    caching.invalidate(using)
@@ -1,3 +1,1280 @@
-from django.test import TestCase
+import contextvars
+import datetime
+import io
+import json
+import re
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import QueryDict
+from django.db import connection, transaction
+from django.db.utils import ConnectionHandler
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import benchmark, caching, exporters, jobs, search, synthetic
+from .checks import check_background_reports_cache
+from .importers import ExpenseImporter, iter_json_rows, iter_rows
+from .models import (
+    Category, Expense, ExpenseQuerySet, ExpenseRollup, ExpenseRollupManager, ReportJob,
+    rollups_deferred,
+)
+from .querybudget import QueryBudgetExceeded, QueryBudgetTestMixin, count_queries
+from .routers import ReadReplicaRouter
+from .reports import summary_per_category, summary_per_year_month
+from .timeseries import TimeSeries, period_label, period_start, time_series
+
+
+# Tests cache into local memory, never into the application's shared cache,
+# where entries computed from test data would be served as real ones.
+TEST_CACHES = {
+    **settings.CACHES,
+    caching.get_cache_alias(): {
+        **settings.CACHES[caching.get_cache_alias()],
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'expenses-tests',
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ExpensesTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        # Test transactions roll back without bumping the cache version.
+        caching.get_cache().clear()
+
+
+def rollup_state():
+    return sorted(
+        ExpenseRollup.objects.values_list('category_id', 'year', 'month', 'total', 'count'),
+        key=str)
+
+
+def live_state():
+    return sorted(
+        ((row.category_id, row.year, row.month, row.total, row.count)
+         for row in ExpenseRollup.objects._aggregate(Expense.objects.all())),
+        key=str)
+
+
+class ExpenseRollupTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='food')
+        cls.home = Category.objects.create(name='home')
+
+    def assertRollupsInSync(self):
+        self.assertEqual(rollup_state(), live_state())
+
+    def test_save_and_delete(self):
+        expense = Expense.objects.create(
+            category=self.food, name='bread', amount='3.50', date=datetime.date(2022, 1, 10))
+        Expense.objects.create(name='misc', amount='1.00', date=datetime.date(2022, 1, 11))
+        self.assertRollupsInSync()
+
+        expense.category = self.home
+        expense.date = datetime.date(2022, 2, 1)
+        expense.amount = Decimal('4.00')
+        expense.save()
+        self.assertRollupsInSync()
+        self.assertFalse(ExpenseRollup.objects.filter(category=self.food).exists())
+
+        expense.delete()
+        self.assertRollupsInSync()
+
+    def test_bulk_operations(self):
+        objs = Expense.objects.bulk_create([
+            Expense(category=self.food, name=f'e{i}', amount='2.00',
+                    date=datetime.date(2022, 1 + i % 3, 1))
+            for i in range(12)
+        ])
+        self.assertRollupsInSync()
+
+        Expense.objects.filter(date__month=1).update(category=self.home)
+        self.assertRollupsInSync()
+
+        Expense.objects.filter(date__month=2).update(date=datetime.date(2021, 12, 31))
+        self.assertRollupsInSync()
+
+        for obj in objs:
+            obj.amount = Decimal('5.25')
+        Expense.objects.bulk_update(objs, ['amount'])
+        self.assertRollupsInSync()
+
+        Expense.objects.filter(date__year=2021).delete()
+        self.assertRollupsInSync()
+
+    def test_deferred_rebuilds_only_on_success(self):
+        with mock.patch.object(ExpenseRollupManager, 'rebuild') as rebuild:
+            with self.assertRaises(ValueError), rollups_deferred():
+                raise ValueError
+            rebuild.assert_not_called()
+            with rollups_deferred():
+                pass
+            rebuild.assert_called_once_with()
+
+    def test_rebuild_command(self):
+        Expense.objects.create(category=self.food, name='x', amount='1.00')
+        ExpenseRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertRollupsInSync()
+
+
+class SummaryTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='food')
+        Expense.objects.create(category=cls.food, name='bread', amount='3.00',
+                               date=datetime.date(2022, 1, 10))
+        Expense.objects.create(category=cls.food, name='milk', amount='2.00',
+                               date=datetime.date(2022, 2, 10))
+        Expense.objects.create(name='tram', amount='1.50', date=datetime.date(2022, 2, 20))
+
+    def test_rollup_matches_live_aggregate(self):
+        queryset = Expense.objects.all()
+        for filters in ({}, {'categories': [self.food]},
+                        {'date_from': datetime.date(2022, 2, 1),
+                         'date_to': datetime.date(2022, 2, 28)}):
+            filtered = queryset
+            if 'categories' in filters:
+                filtered = filtered.filter(category__in=filters['categories'])
+            if 'date_from' in filters:
+                filtered = filtered.filter(date__range=(filters['date_from'], filters['date_to']))
+            with self.assertNumQueries(2) as ctx:
+                from_rollup = summary_per_category(filtered, filters)
+            self.assertIn('expenses_expenserollup', ctx.captured_queries[0]['sql'])
+            self.assertEqual(from_rollup, summary_per_category(filtered))
+            self.assertEqual(summary_per_year_month(filtered, filters),
+                             summary_per_year_month(filtered))
+
+    def test_totals_are_quantized(self):
+        # 3.00 + 0.10 + 0.20 is 3.3000000000000003 in floating point.
+        Expense.objects.create(category=self.food, name='a', amount='0.10',
+                               date=datetime.date(2022, 1, 11))
+        Expense.objects.create(category=self.food, name='b', amount='0.20',
+                               date=datetime.date(2022, 1, 12))
+        january = {'date_from': datetime.date(2022, 1, 1), 'date_to': datetime.date(2022, 1, 31)}
+        for filters in ({}, january, {'name': 'a'}):
+            for summary in (summary_per_category(Expense.objects.all(), filters),
+                            summary_per_year_month(Expense.objects.all(), filters)):
+                for total in summary.values():
+                    self.assertEqual(total.as_tuple().exponent, -2, (filters, summary))
+        self.assertEqual(
+            str(summary_per_year_month(Expense.objects.all(), january)[datetime.date(2022, 1, 1)]),
+            '3.30')
+        self.assertEqual(str(Category.objects.with_stats().get(pk=self.food.pk).expense_total),
+                         '5.30')
+
+    def test_name_search_falls_back_to_live_aggregate(self):
+        queryset = Expense.objects.filter(name__icontains='milk')
+        self.assertEqual(summary_per_category(queryset, {'name': 'milk'}),
+                         {'food': Decimal('2.00')})
+        self.assertEqual(summary_per_year_month(queryset, {'name': 'milk'}),
+                         {datetime.date(2022, 2, 1): Decimal('2.00')})
+
+    def test_last_representable_date(self):
+        last = Expense.objects.create(category=self.food, name='far', amount='1.00',
+                                      date=datetime.date.max)
+        self.assertEqual(rollup_state(), live_state())
+        last.delete()
+        self.assertEqual(rollup_state(), live_state())
+        query = {'date_from': '9999-12-01', 'date_to': '9999-12-31'}
+        for name in ('expense-list', 'expense-report', 'api-summary-category',
+                     'api-summary-year-month', 'api-timeseries'):
+            response = self.client.get(reverse(f'expenses:{name}'), query)
+            self.assertEqual(response.status_code, 200, name)
+
+    def test_list_view(self):
+        response = self.client.get(reverse('expenses:expense-list'), {'name': 'bread'})
+        self.assertEqual(response.context['summary_per_category'], {'food': Decimal('3.00')})
+        response = self.client.get(reverse('expenses:expense-list'))
+        self.assertEqual(response.context['summary_per_year_month'], {
+            datetime.date(2022, 1, 1): Decimal('3.00'),
+            datetime.date(2022, 2, 1): Decimal('3.50'),
+        })
+
+
+class KeysetPaginationTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        food = Category.objects.create(name='food')
+        home = Category.objects.create(name='home')
+        Expense.objects.bulk_create([
+            Expense(category=(food, home, None)[i % 3], name=f'e{i}',
+                    amount=Decimal(i % 4), date=datetime.date(2022, 1, 1 + i % 5))
+            for i in range(23)
+        ])
+
+    def walk(self, params):
+        url = reverse('expenses:expense-list')
+        seen, pages, cursor = [], [], None
+        while True:
+            response = self.client.get(url, {**params, **({'cursor': cursor} if cursor else {})})
+            page = response.context['page_obj']
+            pages.append((page, response))
+            seen += [obj.pk for obj in page]
+            cursor = page.next_cursor
+            if not cursor:
+                return seen, pages
+
+    def test_matches_offset_pagination(self):
+        for sort in ('', '-date', 'date', 'category', '-category', 'amount', '-amount'):
+            response = self.client.get(reverse('expenses:expense-list'), {'sort': sort})
+            expected = [obj.pk for obj in response.context['paginator'].object_list]
+            with self.settings(EXPENSES_PAGINATION_MODE='keyset'):
+                seen, pages = self.walk({'sort': sort})
+            self.assertEqual(seen, expected, sort)
+
+    @override_settings(EXPENSES_PAGINATION_MODE='keyset')
+    def test_previous_cursor_and_filters(self):
+        seen, pages = self.walk({'name': 'e', 'sort': 'amount'})
+        self.assertEqual(len(pages), 5)
+        last, response = pages[-1]
+        self.assertContains(response, 'name=e&amp;sort=amount&amp;cursor=')
+        self.assertEqual(last.start_index(), 21)
+
+        response = self.client.get(reverse('expenses:expense-list'),
+                                   {'name': 'e', 'sort': 'amount', 'cursor': last.previous_cursor})
+        previous = response.context['page_obj']
+        self.assertEqual([obj.pk for obj in previous], [obj.pk for obj in pages[-2][0]])
+        self.assertEqual(previous.start_index(), 16)
+        self.assertTrue(previous.has_next())
+
+    @override_settings(EXPENSES_PAGINATION_MODE='keyset')
+    def test_stale_cursor(self):
+        seen, pages = self.walk({})
+        cursor = pages[-2][0].next_cursor
+        Expense.objects.filter(pk__in=seen[-5:]).delete()
+        response = self.client.get(reverse('expenses:expense-list'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        page = response.context['page_obj']
+        self.assertEqual(list(page), [])
+        self.assertFalse(page.has_next())
+        self.assertIsNone(page.next_cursor)
+        self.assertIsNone(page.previous_cursor)
+        self.assertContains(response, 'first')
+        self.assertNotContains(response, 'previous')
+
+        response = self.client.get(reverse('expenses:api-expense-list'),
+                                   {'page_size': 5, 'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [])
+        self.assertIsNone(response.json()['next'])
+
+    @override_settings(EXPENSES_PAGINATION_MODE='keyset')
+    def test_invalid_cursor(self):
+        seen, pages = self.walk({'sort': 'amount'})
+        response = self.client.get(reverse('expenses:expense-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+        # A cursor issued for one sort order is rejected under another.
+        response = self.client.get(reverse('expenses:expense-list'),
+                                   {'sort': 'date', 'cursor': pages[0][0].next_cursor})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class QueryBudgetTests(QueryBudgetTestMixin, ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categories = Category.objects.bulk_create(
+            Category(name=f'category {i}') for i in range(5))
+        Expense.objects.bulk_create([
+            Expense(category=categories[i % 5], name=f'e{i}', amount='1.00')
+            for i in range(20)
+        ])
+        cls.expense = Expense.objects.first()
+
+    def test_views_within_budget(self):
+        urls = [
+            reverse('expenses:expense-list'),
+            reverse('expenses:expense-list') + '?sort=category&page=3',
+            reverse('expenses:expense-edit', args=[self.expense.pk]),
+            reverse('expenses:expense-delete', args=[self.expense.pk]),
+            reverse('expenses:category-list'),
+        ]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_writes_within_budget(self):
+        response = self.client.post(
+            reverse('expenses:expense-edit', args=[self.expense.pk]),
+            {'name': 'x', 'amount': '2.00', 'date': '2022-01-01'})
+        self.assertRedirects(response, reverse('expenses:expense-list'))
+        response = self.client.post(reverse('expenses:expense-delete', args=[self.expense.pk]))
+        self.assertRedirects(response, reverse('expenses:expense-list'))
+
+    def test_expense_list_does_not_query_per_row(self):
+        with self.settings(EXPENSES_PAGINATION_MODE='offset'):
+            with self.assertQueryBudget(6):
+                self.client.get(reverse('expenses:expense-list'))
+            with self.assertQueryBudget(6):
+                self.client.get(reverse('expenses:expense-list'), {'sort': '-category'})
+
+    def test_over_budget_raises(self):
+        with self.settings(QUERY_BUDGETS={'expenses:expense-list': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('expenses:expense-list'))
+
+    def test_overlapping_counters(self):
+        # Two async requests on one thread: the first to finish must not
+        # take the other's wrapper with it.
+        first, second = contextvars.copy_context(), contextvars.copy_context()
+        first_block, second_block = count_queries(), count_queries()
+        first.run(first_block.__enter__)
+        stats = second.run(second_block.__enter__)
+        first.run(first_block.__exit__, None, None, None)
+        second.run(lambda: [Expense.objects.count() for _ in range(3)])
+        second.run(second_block.__exit__, None, None, None)
+        self.assertEqual(stats.count, 3)
+        self.assertNotIn(stats, connection.execute_wrappers)
+
+
+class SearchTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.coffee = Expense.objects.create(name='Coffee beans', amount='30.00')
+        cls.latte = Expense.objects.create(name='Café latte coffee coffee', amount='12.00')
+        cls.bus = Expense.objects.create(name='Bus ticket', amount='3.00')
+
+    def names(self, text, **kwargs):
+        return [obj.name for obj in search.search(Expense.objects.order_by('pk'), text, **kwargs)]
+
+    def test_prefix_and_multi_term(self):
+        self.assertEqual(self.names('cof'), ['Coffee beans', 'Café latte coffee coffee'])
+        self.assertEqual(self.names('coffee BEA'), ['Coffee beans'])
+        self.assertEqual(self.names('cafe'), ['Café latte coffee coffee'])
+        self.assertEqual(self.names('"tick'), ['Bus ticket'])
+        self.assertEqual(self.names('train'), [])
+
+    def test_ranked(self):
+        queryset = search.search(Expense.objects.all(), 'coffee', ranked=True)
+        self.assertEqual([obj.pk for obj in queryset.order_by('search_rank', 'pk')],
+                         [self.latte.pk, self.coffee.pk])
+
+    def test_ranked_search_drives_from_index(self):
+        # Probing the index once per expense row re-runs the MATCH each time.
+        queryset = search.search(
+            Expense.objects.filter(date__gte='2000-01-01', category__isnull=True),
+            'coffee', ranked=True)
+        self.assertFalse(queryset.query.extra)
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[3] for row in cursor.fetchall()]
+        self.assertIn('VIRTUAL TABLE', plan[0])
+
+    def test_index_follows_writes(self):
+        self.bus.name = 'Tram ticket'
+        self.bus.save()
+        self.assertEqual(self.names('bus'), [])
+        self.assertEqual(self.names('tram'), ['Tram ticket'])
+
+        Expense.objects.filter(pk=self.coffee.pk).update(name='Tea')
+        self.assertEqual(self.names('coffee'), ['Café latte coffee coffee'])
+
+        Expense.objects.filter(name__startswith='Caf').delete()
+        self.assertEqual(self.names('coffee'), [])
+        self.assertEqual(self.names('tea'), ['Tea'])
+
+    def test_rebuild_command(self):
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.names('bus'), ['Bus ticket'])
+
+    def test_list_view_orders_by_relevance(self):
+        response = self.client.get(reverse('expenses:expense-list'), {'name': 'coffee'})
+        self.assertEqual(list(response.context['object_list']), [self.latte, self.coffee])
+        self.assertEqual(response.context['summary_per_category'], {'-': Decimal('42.00')})
+        response = self.client.get(reverse('expenses:expense-list'),
+                                   {'name': 'coffee', 'sort': 'amount'})
+        self.assertEqual(list(response.context['object_list']), [self.latte, self.coffee])
+        response = self.client.get(reverse('expenses:expense-list'),
+                                   {'name': 'coffee', 'sort': '-amount'})
+        self.assertEqual(list(response.context['object_list']), [self.coffee, self.latte])
+
+    @override_settings(EXPENSES_PAGINATION_MODE='keyset')
+    def test_keyset_pagination_over_relevance(self):
+        Expense.objects.bulk_create(
+            Expense(name=f'coffee {i}', amount='1.00') for i in range(10))
+        url = reverse('expenses:expense-list')
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(url, {'name': 'coffee', **({'cursor': cursor} if cursor else {})})
+            seen += [obj.pk for obj in response.context['page_obj']]
+            cursor = response.context['page_obj'].next_cursor
+            if not cursor:
+                break
+        self.assertEqual(seen, [obj.pk for obj in search.search(
+            Expense.objects.all(), 'coffee', ranked=True).order_by('search_rank', 'pk')])
+
+
+class CategoryListTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='food')
+        cls.home = Category.objects.create(name='home')
+        cls.empty = Category.objects.create(name='empty')
+        Expense.objects.bulk_create([
+            Expense(category=cls.food, name='bread', amount='3.00', date=datetime.date(2022, 1, 5)),
+            Expense(category=cls.food, name='milk', amount='2.00', date=datetime.date(2022, 3, 1)),
+            Expense(category=cls.home, name='lamp', amount='40.00', date=datetime.date(2021, 12, 24)),
+            Expense(name='misc', amount='1.00', date=datetime.date(2022, 2, 2)),
+        ])
+
+    def get(self, sort):
+        return self.client.get(reverse('expenses:category-list'), {'sort': sort})
+
+    def test_stats(self):
+        stats = {
+            obj.name: (obj.expense_count, obj.expense_total, obj.first_date, obj.last_date)
+            for obj in Category.objects.with_stats()
+        }
+        self.assertEqual(stats, {
+            'food': (2, Decimal('5.00'), datetime.date(2022, 1, 5), datetime.date(2022, 3, 1)),
+            'home': (1, Decimal('40.00'), datetime.date(2021, 12, 24), datetime.date(2021, 12, 24)),
+            'empty': (0, Decimal('0'), None, None),
+        })
+
+    def test_sortable_columns(self):
+        cases = {
+            '': ['empty', 'food', 'home'],
+            '-name': ['home', 'food', 'empty'],
+            '-count': ['food', 'home', 'empty'],
+            'total': ['empty', 'food', 'home'],
+            'first': ['home', 'food', 'empty'],
+            '-last': ['food', 'home', 'empty'],
+            'bogus': ['empty', 'food', 'home'],
+        }
+        for sort, names in cases.items():
+            caching.get_cache().clear()
+            with self.subTest(sort=sort), self.assertNumQueries(2):
+                response = self.get(sort)
+            self.assertEqual([obj.name for obj in response.context['object_list']], names)
+
+    def test_follows_writes(self):
+        self.get('-total')
+        Expense.objects.create(category=self.empty, name='vase', amount='99.00',
+                               date=datetime.date(2023, 1, 1))
+        response = self.get('-total')
+        self.assertEqual(response.context['object_list'][0], self.empty)
+        self.assertContains(response, '99.00')
+
+
+class ImportTests(ExpensesTestCase):
+    csv_data = (
+        'name,amount,date,category\n'
+        'Bread,3.50,2022-01-10,food\n'
+        'Rent,1200.00,2022-01-01,home\n'
+        ',1.00,2022-01-01,food\n'
+        'Milk,abc,2022-01-01,food\n'
+        'Tram,2.80,,\n'
+        'Cheese,12.00,2022-01-31,food\n'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='food')
+
+    def test_csv_import(self):
+        importer = ExpenseImporter(batch_size=2)
+        with self.assertNumQueries(1):
+            ExpenseImporter()
+        result = importer.run(iter_rows(io.StringIO(self.csv_data), 'csv'))
+
+        self.assertEqual((result.rows, result.created, result.created_categories),
+                         (6, 4, ['home']))
+        self.assertEqual([number for number, _ in result.errors], [3, 4])
+        self.assertIn('name', result.errors[0][1])
+        self.assertIn('amount', result.errors[1][1])
+        self.assertEqual(
+            sorted(Expense.objects.values_list('name', 'category__name')),
+            [('Bread', 'food'), ('Cheese', 'food'), ('Rent', 'home'), ('Tram', None)])
+        self.assertEqual(Expense.objects.get(name='Tram').date, datetime.date.today())
+        self.assertEqual(summary_per_category(Expense.objects.all(), {})['food'], Decimal('15.50'))
+        self.assertEqual(search.search(Expense.objects.all(), 'chee').get().name, 'Cheese')
+
+    def test_dry_run(self):
+        result = ExpenseImporter(dry_run=True).run(iter_rows(io.StringIO(self.csv_data), 'csv'))
+        self.assertEqual((result.created, result.failed, result.created_categories), (4, 2, ['home']))
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(Category.objects.filter(name='home').exists())
+
+    def test_json_streaming(self):
+        rows = [{'name': f'e{i}', 'amount': f'{i}.25', 'category': 'food'} for i in range(50)]
+        array = io.StringIO(json.dumps(rows, indent=2))
+        ndjson = io.StringIO('\n'.join(json.dumps(row) for row in rows) + '\n')
+        with mock.patch('expenses.importers.JSON_CHUNK_SIZE', 7):
+            self.assertEqual(list(iter_json_rows(array)), rows)
+            self.assertEqual(list(iter_json_rows(ndjson)), rows)
+        with self.assertRaises(ValueError):
+            list(iter_json_rows(io.StringIO('[{"name": "x"')))
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('\ufeff' + self.csv_data)
+            f.flush()
+            out, err = io.StringIO(), io.StringIO()
+            call_command('import_expenses', f.name, batch_size=3, stdout=out, stderr=err)
+        self.assertIn('Imported 4 of 6 rows (1 new categories, 2 errors).', out.getvalue())
+        self.assertIn('row 4: amount:', err.getvalue())
+        self.assertEqual(Expense.objects.count(), 4)
+
+    def test_error_cap(self):
+        rows = [{'name': '', 'amount': '1.00'}] * 7 + [{'name': 'ok', 'amount': '1.00'}]
+        result = ExpenseImporter(batch_size=3, max_errors=5).run(rows)
+        self.assertEqual((result.rows, result.created, result.failed), (8, 1, 7))
+        self.assertEqual([number for number, _ in result.errors], [1, 2, 3, 4, 5])
+
+    def test_upload_view(self):
+        # Spreadsheets save CSV with a byte order mark in front of the header.
+        upload = SimpleUploadedFile('bank.csv', self.csv_data.encode('utf-8-sig'))
+        response = self.client.post(reverse('expenses:expense-import'), {'file': upload})
+        self.assertEqual(response.context['result'].created, 4)
+        self.assertContains(response, 'Imported')
+        self.assertEqual(Expense.objects.count(), 4)
+
+        upload = SimpleUploadedFile('bank.txt', b'whatever')
+        response = self.client.post(reverse('expenses:expense-import'), {'file': upload})
+        self.assertFormError(response.context['form'], 'format',
+                             'Cannot tell the format from the file name.')
+
+
+class ExportTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        food = Category.objects.create(name='food')
+        cls.bread = Expense.objects.create(category=food, name='Bread, white', amount='3.50',
+                                           date=datetime.date(2022, 1, 10))
+        cls.tram = Expense.objects.create(name='Tram', amount='2.80',
+                                          date=datetime.date(2022, 2, 1))
+
+    def test_csv_export_applies_list_filters(self):
+        response = self.client.get(reverse('expenses:expense-export'), {'date_to': '2022-01-31'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(b''.join(response.streaming_content).decode(), (
+            'id,date,name,amount,category\r\n'
+            f'{self.bread.pk},2022-01-10,"Bread, white",3.50,food\r\n'))
+
+    def test_ndjson_export(self):
+        response = self.client.get(reverse('expenses:expense-export'),
+                                   {'format': 'ndjson', 'sort': 'amount'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(rows, [
+            {'id': self.tram.pk, 'date': '2022-02-01', 'name': 'Tram',
+             'amount': '2.80', 'category': None},
+            {'id': self.bread.pk, 'date': '2022-01-10', 'name': 'Bread, white',
+             'amount': '3.50', 'category': 'food'},
+        ])
+        response = self.client.get(reverse('expenses:expense-export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_filters(self):
+        response = self.client.get(reverse('expenses:expense-export'),
+                                   {'date_from': '2022-13-01', 'format': 'csv'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date_from', response.json()['errors'])
+
+    def test_export_streams_in_chunks(self):
+        with mock.patch.object(ExpenseQuerySet, 'iterator', return_value=iter([])) as iterator:
+            list(exporters.export(Expense.objects.all(), 'csv', chunk_size=10))
+        iterator.assert_called_once_with(chunk_size=10)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.ndjson') as f:
+            call_command('export_expenses', format='ndjson', output=f.name, category=['food'])
+            self.assertEqual([json.loads(line)['name'] for line in f], ['Bread, white'])
+        out = io.StringIO()
+        call_command('export_expenses', sort='amount', stdout=out)
+        self.assertEqual(out.getvalue(), (
+            'id,date,name,amount,category\r\n'
+            f'{self.tram.pk},2022-02-01,Tram,2.80,\r\n'
+            f'{self.bread.pk},2022-01-10,"Bread, white",3.50,food\r\n'))
+
+
+class CachingTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='food')
+        cls.expense = Expense.objects.create(category=cls.food, name='Bread', amount='3.00')
+
+    def test_normalize_params(self):
+        self.assertEqual(
+            caching.normalize_params(QueryDict('page=2&name=&categories=3&categories=1&sort=date')),
+            caching.normalize_params(QueryDict('sort=date&categories=1&categories=3&page=2')))
+        self.assertEqual(
+            caching.normalize_params(QueryDict('page=2&sort=date'), exclude=('page',)), 'sort=date')
+
+    def test_repeated_list_request_hits_cache(self):
+        url = reverse('expenses:expense-list')
+        self.client.get(url, {'sort': 'amount'})
+        with self.assertNumQueries(1):  # the category choices in the search form
+            response = self.client.get(url, {'sort': 'amount'})
+        self.assertContains(response, 'Bread')
+        self.assertEqual(response.context['summary_per_category'], {'food': Decimal('3.00')})
+
+    def test_writes_invalidate(self):
+        url = reverse('expenses:expense-list')
+        self.client.get(url)
+        self.expense.name = 'Rye bread'
+        self.expense.save()
+        self.assertContains(self.client.get(url), 'Rye bread')
+
+        Expense.objects.filter(pk=self.expense.pk).update(amount='5.00')
+        self.assertEqual(self.client.get(url).context['summary_per_category'],
+                         {'food': Decimal('5.00')})
+
+        Expense.objects.bulk_create([Expense(name='Tram', amount='1.00')])
+        self.assertEqual(self.client.get(url).context['paginator'].count, 2)
+
+        self.food.name = 'groceries'
+        self.food.save()
+        self.assertContains(self.client.get(url), 'groceries')
+
+    def test_category_list_fragment(self):
+        url = reverse('expenses:category-list')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), 'food')
+        Category.objects.create(name='home')
+        self.assertContains(self.client.get(url), 'home')
+
+    def test_evicted_version_does_not_go_back(self):
+        version = caching.data_version()
+        caching.get_cache().delete(caching.VERSION_KEY)
+        self.assertGreater(caching.data_version(), version)
+
+
+class ApiTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='food')
+        cls.home = Category.objects.create(name='home')
+        cls.bread = Expense.objects.create(category=cls.food, name='Bread', amount='3.50',
+                                           date=datetime.date(2022, 1, 10))
+        cls.lamp = Expense.objects.create(category=cls.home, name='Lamp', amount='40.00',
+                                          date=datetime.date(2022, 2, 1))
+        cls.milk = Expense.objects.create(category=cls.food, name='Milk', amount='1.25',
+                                          date=datetime.date(2022, 2, 3))
+
+    list_url = reverse('expenses:api-expense-list')
+
+    def detail_url(self, obj):
+        return reverse('expenses:api-expense-detail', args=[getattr(obj, 'pk', obj)])
+
+    def send(self, method, url, data):
+        return getattr(self.client, method)(url, json.dumps(data), content_type='application/json')
+
+    def test_list_filter_sort_paginate(self):
+        response = self.client.get(self.list_url, {'sort': 'amount', 'page_size': 2})
+        data = response.json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['total'], '44.75')
+        self.assertEqual([row['name'] for row in data['results']], ['Milk', 'Bread'])
+        self.assertEqual(data['results'][0], {
+            'id': self.milk.pk, 'date': '2022-02-03', 'name': 'Milk', 'amount': '1.25',
+            'category_id': self.food.pk, 'category': 'food'})
+        self.assertIsNone(data['previous'])
+
+        data = self.client.get(self.list_url, {
+            'sort': 'amount', 'page_size': 2, 'cursor': data['next']}).json()
+        self.assertEqual([row['name'] for row in data['results']], ['Lamp'])
+        self.assertIsNone(data['next'])
+        self.assertIsNotNone(data['previous'])
+
+        data = self.client.get(self.list_url, {'categories': self.food.pk, 'name': 'mil'}).json()
+        self.assertEqual((data['count'], data['total']), (1, '1.25'))
+
+        response = self.client.get(self.list_url, {'date_from': 'soon'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date_from', response.json()['errors'])
+        self.assertEqual(self.client.get(self.list_url, {'cursor': 'x'}).status_code, 400)
+
+    def test_summaries(self):
+        response = self.client.get(reverse('expenses:api-summary-category'))
+        self.assertEqual(response.json()['results'], [
+            {'category': 'food', 'total': '4.75'}, {'category': 'home', 'total': '40.00'}])
+        response = self.client.get(reverse('expenses:api-summary-year-month'),
+                                   {'date_from': '2022-02-02'})
+        self.assertEqual(response.json()['results'], [{'period': '2022-02', 'total': '1.25'}])
+
+    def test_etag(self):
+        url = reverse('expenses:api-summary-category')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.client.get(url, {'categories': self.food.pk})['ETag'], etag)
+
+        Expense.objects.create(category=self.home, name='Rug', amount='10.00')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_crud(self):
+        response = self.send('post', self.list_url, {
+            'name': 'Tea', 'amount': '2.10', 'date': '2022-03-01', 'category': self.food.pk})
+        self.assertEqual(response.status_code, 201)
+        tea = Expense.objects.get(pk=response.json()['id'])
+        self.assertEqual(self.client.get(self.detail_url(tea)).json()['category'], 'food')
+
+        response = self.send('patch', self.detail_url(tea), {'amount': '2.50'})
+        self.assertEqual(response.json()['amount'], '2.50')
+        response = self.send('put', self.detail_url(tea), {'amount': '2.50'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['errors']), {'name', 'date'})
+        response = self.send('put', self.detail_url(tea), {
+            'name': 'Green tea', 'amount': '3.00', 'date': '2022-04-01', 'category': None})
+        self.assertEqual(response.json()['category'], None)
+        self.assertEqual(summary_per_category(Expense.objects.all(), {})['-'], Decimal('3.00'))
+
+        self.assertEqual(self.client.delete(self.detail_url(tea)).status_code, 204)
+        self.assertEqual(self.client.get(self.detail_url(tea)).status_code, 404)
+        self.assertEqual(self.client.post(self.list_url, 'nope',
+                                          content_type='application/json').status_code, 400)
+
+    async def test_async_client(self):
+        response = await self.async_client.get(self.list_url, {'page_size': 1})
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(response.asgi_request.query_stats.count, 2)
+        response = await self.async_client.get(
+            self.list_url, {'page_size': 1}, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+
+class TimeSeriesTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='food')
+        cls.home = Category.objects.create(name='home')
+        for category, name, amount, date in (
+            (cls.food, 'bread', '3.10', datetime.date(2021, 12, 31)),
+            (cls.food, 'milk', '0.20', datetime.date(2022, 1, 3)),
+            (cls.food, 'cake', '0.10', datetime.date(2022, 1, 3)),
+            (cls.home, 'lamp', '40.00', datetime.date(2022, 4, 2)),
+            (None, 'tram', '1.50', datetime.date(2022, 4, 5)),
+        ):
+            Expense.objects.create(category=category, name=name, amount=amount, date=date)
+
+    def test_periods(self):
+        day = datetime.date(2022, 5, 18)
+        self.assertEqual(
+            [period_label(period_start(day, g), g)
+             for g in ('day', 'week', 'month', 'quarter', 'year')],
+            ['2022-05-18', '2022-W20', '2022-05', '2022-Q2', '2022'])
+        with self.assertRaises(ValueError):
+            period_start(day, 'decade')
+
+    def test_pivot(self):
+        series = time_series(Expense.objects.all(), 'quarter')
+        self.assertEqual(series.columns, ['-', 'food', 'home'])
+        self.assertEqual([period_label(p, 'quarter') for p in series.periods],
+                         ['2021-Q4', '2022-Q1', '2022-Q2'])
+        self.assertEqual(list(series.column('food')), [310, 30, 0])
+        self.assertEqual(list(series.totals), [310, 30, 4150])
+        self.assertEqual(list(series.running_totals), [310, 340, 4490])
+
+        rows = series.rows()
+        self.assertEqual(rows[1].amounts, [0, Decimal('0.30'), 0])
+        self.assertEqual(rows[2].running, [Decimal('1.50'), Decimal('3.40'), Decimal('40.00')])
+        self.assertEqual(rows[0].deltas, [None] * 3)
+        self.assertEqual(rows[1].deltas, [0, Decimal('-2.80'), 0])
+        self.assertEqual((rows[0].delta, rows[2].delta), (None, Decimal('41.20')))
+
+    def test_empty_periods_are_filled(self):
+        series = time_series(Expense.objects.filter(category=self.food), 'day')
+        self.assertEqual(len(series.periods), 4)
+        self.assertEqual(list(series.totals), [310, 0, 0, 30])
+        series = time_series(Expense.objects.filter(category=self.food), 'week')
+        self.assertEqual([period_label(p, 'week') for p in series.periods],
+                         ['2021-W52', '2022-W01'])
+
+    def test_rollups_match_live_rows(self):
+        filters = {'date_from': datetime.date(2022, 1, 1), 'date_to': datetime.date(2022, 12, 31)}
+        queryset = Expense.objects.filter(date__range=(filters['date_from'], filters['date_to']))
+        for granularity in ('month', 'year'):
+            with self.assertNumQueries(2) as ctx:
+                from_rollup = time_series(queryset, granularity, filters)
+            self.assertIn('expenses_expenserollup', ctx.captured_queries[0]['sql'])
+            live = time_series(queryset, granularity)
+            self.assertEqual((from_rollup.columns, from_rollup.periods, from_rollup.cells),
+                             (live.columns, live.periods, live.cells))
+
+    def test_empty(self):
+        series = time_series(Expense.objects.none(), 'year')
+        self.assertEqual((series.periods, series.rows()), ([], []))
+        self.assertEqual(TimeSeries.from_rows([], 'month').columns, [])
+
+    def test_last_representable_period(self):
+        Expense.objects.create(name='far', amount='1.00', date=datetime.date.max)
+        for granularity in ('day', 'week', 'month', 'quarter', 'year'):
+            series = time_series(Expense.objects.filter(date__year=9999), granularity)
+            self.assertEqual(series.periods[-1], period_start(datetime.date.max, granularity))
+
+    def test_view(self):
+        response = self.client.get(reverse('expenses:expense-report'),
+                                   {'granularity': 'year', 'categories': self.home.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row.label for row in response.context['rows']], ['2022'])
+        self.assertContains(response, '40.00')
+        response = self.client.get(reverse('expenses:expense-report'), {'granularity': 'x'})
+        self.assertEqual(response.context['series'].granularity, 'month')
+
+    def test_api(self):
+        url = reverse('expenses:api-timeseries')
+        response = self.client.get(url, {'granularity': 'year'})
+        data = response.json()
+        self.assertEqual(data['columns'], ['-', 'food', 'home'])
+        self.assertEqual(data['results'][1], {
+            'period': '2022-01-01', 'label': '2022',
+            'amounts': ['1.50', '0.30', '40.00'], 'running': ['1.50', '3.40', '40.00'],
+            'deltas': ['1.50', '-2.80', '40.00'], 'total': '41.80',
+            'running_total': '44.90', 'delta': '38.70'})
+        self.assertIsNone(data['results'][0]['delta'])
+        self.assertEqual(self.client.get(url, {'granularity': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'granularity': 'year'},
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class DatabaseProfileTests(ExpensesTestCase):
+    def test_backend_pragmas_and_transaction_mode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            handler = ConnectionHandler({'default': {
+                'ENGINE': 'expenses.backends.sqlite3',
+                'NAME': f'{tmp}/tuned.sqlite3',
+                'OPTIONS': {
+                    'transaction_mode': 'immediate',
+                    'pragmas': {'journal_mode': 'wal', 'synchronous': 'normal',
+                                'cache_size': -2000, 'temp_store': 'memory'},
+                },
+            }})
+            tuned = handler['default']
+            try:
+                with tuned.cursor() as cursor:
+                    pragmas = {}
+                    for name in ('journal_mode', 'synchronous', 'cache_size', 'temp_store'):
+                        cursor.execute(f'PRAGMA {name}')
+                        pragmas[name] = cursor.fetchone()[0]
+                self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1,
+                                           'cache_size': -2000, 'temp_store': 2})
+                # What atomic() runs to open a transaction.
+                with CaptureQueriesContext(tuned) as ctx:
+                    tuned._start_transaction_under_autocommit()
+                    tuned.cursor().execute('ROLLBACK')
+                self.assertEqual(ctx.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+            finally:
+                tuned.close()
+
+    def test_router(self):
+        router = ReadReplicaRouter()
+        with mock.patch('expenses.routers.get_read_alias', return_value=None):
+            self.assertIsNone(router.db_for_read(Expense))
+            self.assertIsNone(router.db_for_write(Expense))
+        # Outside the test case's own transaction.
+        with mock.patch('expenses.routers.get_read_alias', return_value='replica'), \
+                mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(router.db_for_read(Expense), 'replica')
+            self.assertEqual(router.db_for_read(ExpenseRollup), 'replica')
+            self.assertIsNone(router.db_for_read(User))
+            self.assertEqual(router.db_for_write(Expense), 'default')
+            expense = Expense(name='x', amount=1)
+            expense._state.db = 'default'
+            self.assertEqual(router.db_for_read(Category, instance=expense), 'default')
+        # Inside atomic(), here the test case's transaction, reads stay on the writer.
+        with mock.patch('expenses.routers.get_read_alias', return_value='replica'):
+            self.assertEqual(router.db_for_read(Expense), 'default')
+            self.assertIs(router.allow_migrate('replica', 'expenses'), False)
+            self.assertIsNone(router.allow_migrate('default', 'expenses'))
+
+
+    @override_settings(DATABASE_ROUTERS=['expenses.routers.ReadReplicaRouter'])
+    def test_bulk_writes_stay_on_writer(self):
+        food = Category.objects.create(name='food')
+        atomic = mock.Mock(wraps=transaction.atomic)
+        # Routed as in production outside a transaction, while the queries
+        # still run in the test case's one.
+        with mock.patch('expenses.routers.get_read_alias', return_value='replica'), \
+                mock.patch('expenses.routers.connections',
+                           {'default': mock.Mock(in_atomic_block=False)}), \
+                mock.patch('expenses.models.transaction.atomic', atomic):
+            objs = Expense.objects.bulk_create([
+                Expense(category=food, name=f'e{i}', amount='1.00',
+                        date=datetime.date(2022, 1, 1 + i)) for i in range(3)])
+            Expense.objects.filter(date__day=1).update(date=datetime.date(2022, 2, 1))
+            Expense.objects.bulk_update(objs, ['amount'])
+            ExpenseRollup.objects.rebuild()
+        self.assertEqual({call.kwargs['using'] for call in atomic.call_args_list}, {'default'})
+        self.assertEqual(rollup_state(), live_state())
+
+
+class ProfilingTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        food = Category.objects.create(name='food')
+        Expense.objects.create(category=food, name='bread', amount='3.00',
+                               date=datetime.date(2022, 1, 10))
+
+    def server_timing(self, response):
+        return dict(metric.split(';dur=') for metric in response['Server-Timing'].split(', '))
+
+    @override_settings(EXPENSES_SERVER_TIMING=True)
+    def test_server_timing(self):
+        response = self.client.get(reverse('expenses:expense-list'), {'name': 'bread'})
+        timing = self.server_timing(response)
+        for name in ('form', 'filter', 'paginate', 'count', 'summary_per_category',
+                     'summary_per_year_month', 'render', 'db', 'total'):
+            self.assertIn(name, timing)
+        self.assertGreaterEqual(float(timing['total']), float(timing['render']))
+
+        response = self.client.get(reverse('expenses:api-summary-category'))
+        self.assertIn('summary_per_category', self.server_timing(response))
+        with self.settings(EXPENSES_SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('expenses:expense-list')))
+
+    def test_log_and_report(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log = f'{tmp}/profile.jsonl'
+            with self.settings(EXPENSES_PROFILE_LOG=log, EXPENSES_PROFILE_SAMPLE_RATE=1,
+                               EXPENSES_PROFILE_SLOW_MS=0, EXPENSES_PROFILE_DIR=tmp):
+                for _ in range(3):
+                    self.client.get(reverse('expenses:expense-list'))
+                self.client.get(reverse('expenses:expense-report'), {'granularity': 'year'})
+            with open(log) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual([r['view'] for r in records],
+                             ['expenses:expense-list'] * 3 + ['expenses:expense-report'])
+            self.assertIn('time_series', records[-1]['spans'])
+            self.assertTrue(all(r['profile'].endswith('.pstats') for r in records))
+            with open(records[0]['profile'], 'rb') as f:
+                self.assertTrue(f.read())
+
+            out = io.StringIO()
+            call_command('profile_report', log, '--json', stdout=out)
+            rows = {row['view']: row for row in json.loads(out.getvalue())}
+            self.assertEqual(rows['expenses:expense-list']['requests'], 3)
+            self.assertIn('render', rows['expenses:expense-list']['spans'])
+            self.assertIn('db', rows['expenses:expense-report']['spans'])
+
+            out = io.StringIO()
+            call_command('profile_report', log, '--view', 'expenses:expense-report', stdout=out)
+            self.assertIn('GET expenses:expense-report: 1 requests', out.getvalue())
+            self.assertIn('time_series', out.getvalue())
+
+    @override_settings(EXPENSES_SERVER_TIMING=True)
+    async def test_async_spans(self):
+        response = await self.async_client.get(reverse('expenses:api-timeseries'))
+        self.assertIn('time_series', self.server_timing(response))
+
+
+@override_settings(EXPENSES_BACKGROUND_REPORTS=True)
+class BackgroundReportTests(ExpensesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='food')
+        Expense.objects.create(category=cls.food, name='bread', amount='3.00',
+                               date=datetime.date(2022, 1, 10))
+
+    def get_list(self):
+        return self.client.get(reverse('expenses:expense-list')).context
+
+    def test_serve_last_result_while_refreshing(self):
+        context = self.get_list()
+        self.assertIsNone(context['summary_per_category'])
+        self.assertTrue(context['summaries_refreshing'])
+        self.assertContains(self.client.get(reverse('expenses:expense-list')),
+                            'Summaries are being computed')
+        self.assertEqual(ReportJob.objects.filter(status=ReportJob.PENDING).count(), 2)
+
+        self.assertEqual(jobs.run_worker(processes=0, once=True), 2)
+        context = self.get_list()
+        self.assertEqual(context['summary_per_category'], {'food': Decimal('3.00')})
+        self.assertEqual(context['summary_per_year_month'],
+                         {datetime.date(2022, 1, 1): Decimal('3.00')})
+        self.assertFalse(context['summaries_refreshing'])
+
+        Expense.objects.create(category=self.food, name='milk', amount='2.00',
+                               date=datetime.date(2022, 2, 1))
+        context = self.get_list()
+        self.assertEqual(context['summary_per_category'], {'food': Decimal('3.00')})
+        self.assertTrue(context['summaries_refreshing'])
+
+        jobs.run_worker(processes=0, once=True)
+        self.assertEqual(self.get_list()['summary_per_category'], {'food': Decimal('5.00')})
+        # Superseded results are dropped.
+        self.assertEqual(ReportJob.objects.count(), 2)
+
+    @override_settings(QUERY_BUDGET_RAISE=True)
+    def test_cold_list_within_budget(self):
+        # Both summaries are looked up with one SELECT and queued with one
+        # INSERT, next to the count, categories and page queries.
+        with self.assertNumQueries(5):
+            self.get_list()
+
+    def test_requires_shared_cache(self):
+        self.assertEqual([error.id for error in check_background_reports_cache(None)],
+                         ['expenses.E001'])
+        with tempfile.TemporaryDirectory() as location:
+            caches = {**settings.CACHES, 'expenses': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location}}
+            with self.settings(CACHES=caches):
+                self.assertEqual(check_background_reports_cache(None), [])
+
+    def test_report_view(self):
+        url = reverse('expenses:expense-report')
+        self.assertIsNone(self.client.get(url, {'granularity': 'year'}).context['series'])
+        jobs.run_worker(processes=0, once=True)
+        response = self.client.get(url, {'granularity': 'year'})
+        self.assertEqual(list(response.context['series'].column('food')), [300])
+        self.assertFalse(response.context['refreshing'])
+
+    def test_prune(self):
+        self.get_list()
+        jobs.run_worker(processes=0, once=True)
+        jobs.enqueue('timeseries', 'granularity=year')
+        old = timezone.now() - jobs.RETENTION - datetime.timedelta(hours=1)
+        ReportJob.objects.filter(kind='summary-per-category').update(finished_at=old)
+        self.assertEqual(jobs.prune(), 1)
+        self.assertEqual(sorted(ReportJob.objects.values_list('kind', 'status')), [
+            ('summary-per-year-month', ReportJob.DONE), ('timeseries', ReportJob.PENDING)])
+        # The worker prunes as it starts.
+        ReportJob.objects.filter(kind='summary-per-year-month').update(finished_at=old)
+        jobs.run_worker(processes=0, once=True)
+        self.assertEqual(list(ReportJob.objects.values_list('kind', 'status')),
+                         [('timeseries', ReportJob.DONE)])
+
+    def test_superseded_jobs_are_skipped(self):
+        jobs.enqueue('summary-per-category', '', version=1)
+        jobs.enqueue('summary-per-category', '', version=1)
+        jobs.enqueue('summary-per-category', '', version=2)
+        self.assertEqual([job.version for job in jobs.claim(5)], [2])
+        self.assertEqual(list(ReportJob.objects.values_list('version', 'status')),
+                         [(2, ReportJob.RUNNING)])
+
+    def test_failed_job(self):
+        report = jobs.REPORTS['summary-per-category']
+        broken = jobs.Report(mock.Mock(side_effect=RuntimeError('boom')), report.dump, report.load)
+        self.get_list()
+        with mock.patch.dict(jobs.REPORTS, {'summary-per-category': broken}), \
+                self.assertLogs('expenses.jobs', 'ERROR'):
+            jobs.run_worker(processes=0, once=True)
+        job = ReportJob.objects.get(kind='summary-per-category')
+        self.assertEqual(job.status, ReportJob.FAILED)
+        self.assertIn('boom', job.error)
+        self.assertEqual(jobs.latest('summary-per-category', ''), (None, False))
+
+
+class SyntheticDataTests(ExpensesTestCase):
+    def test_generation_is_deterministic(self):
+        def rows(seed):
+            return [(e.name, e.amount, e.date, e.category_id)
+                    for e in synthetic.iter_expenses(200, [1, 2, 3], seed=seed)]
+        self.assertEqual(rows(7), rows(7))
+        self.assertNotEqual(rows(7), rows(8))
+
+    def test_generate_command(self):
+        call_command('generate_expenses', categories=5, expenses=300, batch_size=64,
+                     stdout=io.StringIO())
+        self.assertEqual(Category.objects.count(), 5)
+        self.assertEqual(Expense.objects.count(), 300)
+        self.assertEqual(rollup_state(), live_state())
+        # Zipf-like: the first category is the most popular one.
+        counts = dict(Expense.objects.values_list('category__name').annotate(Count('pk')))
+        self.assertEqual(max(counts, key=counts.get), synthetic.category_names(5)[0])
+
+        call_command('generate_expenses', categories=5, expenses=10, clear=True,
+                     stdout=io.StringIO())
+        self.assertEqual(Expense.objects.count(), 10)
+        self.assertEqual(rollup_state(), live_state())
+
+    def test_benchmark(self):
+        category_ids = synthetic.generate(3, 60)
+        scenarios = benchmark.build_scenarios(category_ids[0])
+        self.assertIn('list_deep_keyset', [scenario.name for scenario in scenarios])
+        results = benchmark.run(60, scenarios, repeat=2)
+        report = json.loads(json.dumps({'meta': benchmark.metadata(), 'results': results}))
+        self.assertEqual(len(report['results']), len(scenarios))
+        for row in report['results']:
+            self.assertLessEqual(row['p50_ms'], row['p95_ms'])
+            self.assertGreater(row['queries'], 0)
+        comparison = benchmark.compare(report, report)
+        self.assertEqual({row['p50_ratio'] for row in comparison}, {1.0})
+
+
+def expense_list_plan(params):
+    """
+    The indexes the expense list page for `params` may be read from (none
+    when the search hits drive it), and why its order can't be read off
+    them, or None. A filtered amount order can seek on the filter and sort,
+    or walk the amount index and filter, depending on the cursor.
+    """
+    if params.get('name'):
+        return (), None
+    sort = params.get('sort', '-date').lstrip('-')
+    categories = params.get('categories', ())
+    if sort == 'category':
+        return (), 'category names live in another table'
+    if len(categories) > 1:
+        return (('expense_cat_date_id_amount',),
+                'an IN list over several categories yields one sorted run per category')
+    if sort == 'amount' and categories:
+        return (('expense_cat_date_id_amount', 'expense_amount_id'),
+                'the category filter and the amount order need different indexes')
+    if sort == 'amount' and (params.get('date_from') or params.get('date_to')):
+        return (('expense_date_id_cat_amount', 'expense_amount_id'),
+                'the date filter and the amount order need different indexes')
+    if sort == 'amount':
+        return ('expense_amount_id',), None
+    if categories:
+        return ('expense_cat_date_id_amount',), None
+    return ('expense_date_id_cat_amount',), None
+
+
+class QueryPlanTests(ExpensesTestCase):
+    """
+    EXPLAIN QUERY PLAN every query the list views and expenses.reports
+    issue, and fail on full table scans and on temp B-tree sorts, except
+    where the rows to sort are bounded by a key list (search hits, selected
+    categories), come from the small rollup table, or the order of the
+    expense list page is known to be unindexable (see expense_list_plan).
+    """
+    list_params = [
+        {},
+        {'sort': 'date'},
+        {'sort': 'amount'},
+        {'sort': '-amount'},
+        {'sort': 'category'},
+        {'sort': '-category'},
+        {'date_from': '2022-01-03'},
+        {'date_to': '2022-01-20'},
+        {'date_from': '2022-01-01', 'date_to': '2022-01-31'},
+        {'date_from': '2022-01-03', 'sort': 'date'},
+        {'date_from': '2022-01-03', 'sort': 'amount'},
+        {'categories': ['1']},
+        {'categories': ['1'], 'sort': 'date'},
+        {'categories': ['1'], 'date_from': '2022-01-03'},
+        {'categories': ['1'], 'sort': '-amount'},
+        {'categories': ['1', '2']},
+        {'categories': ['1', '2'], 'sort': '-amount'},
+        {'name': 'bre'},
+        {'name': 'bre', 'sort': 'amount'},
+        {'name': 'bre', 'date_from': '2022-01-01', 'categories': ['1']},
+        {'page': '2'},
+        {'sort': 'amount', 'page': '2'},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(pk=pk, name=name)
+                      for pk, name in ((1, 'food'), (2, 'home'), (3, 'transport'))]
+        Expense.objects.bulk_create([
+            Expense(category=categories[i % 3] if i % 4 else None, name=f'bread {i}',
+                    amount=Decimal(i % 7), date=datetime.date(2022, 1, 1 + i % 28))
+            for i in range(40)
+        ])
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[3] for row in cursor.fetchall()]
+
+    def check_plans(self, queries, allow_sort=None, allow_scan=()):
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            plan = self.explain(sql)
+            message = f'{sql}\n{plan}'
+            if re.fullmatch(r'SELECT COUNT\(\*\) AS "__count" FROM "\w+"', sql):
+                continue  # unfiltered counts are answered from the count cache
+            for step in plan:
+                if (step.startswith('SCAN') and 'INDEX' not in step
+                        and step.split()[1] not in allow_scan):
+                    self.fail(f'Full table scan: {message}')
+            if allow_sort or not any('TEMP B-TREE' in step for step in plan):
+                continue
+            access = [step for step in plan if step.startswith(('SCAN', 'SEARCH'))]
+            bounded = all(
+                'INTEGER PRIMARY KEY' in step or 'VIRTUAL TABLE' in step
+                or step.split()[1] in ('expenses_expenserollup', 'expenses_category')
+                for step in access)
+            if not bounded:
+                self.fail(f'Temp B-tree sort: {message}')
+
+    def capture(self, url, params):
+        caching.get_cache().clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, ctx.captured_queries
+
+    def check_list_plans(self, queries, params):
+        indexes, allow_sort = expense_list_plan(params)
+        pages = [query for query in queries
+                 if re.search(r'FROM "expenses_expense"\s.* LIMIT ', query['sql'])]
+        self.assertEqual(len(pages), 1, queries)
+        self.check_plans([query for query in queries if query not in pages])
+        self.check_plans(pages, allow_sort)
+        if indexes:
+            plan = self.explain(pages[0]['sql'])
+            pattern = rf'(SCAN|SEARCH) expenses_expense USING (COVERING )?INDEX ({"|".join(indexes)})\b'
+            self.assertTrue(any(re.match(pattern, step) for step in plan),
+                            f'None of {indexes} used: {pages[0]["sql"]}\n{plan}')
+
+    def test_expense_list(self):
+        for mode in ('offset', 'keyset'):
+            for params in self.list_params:
+                if mode == 'keyset':
+                    params = {key: value for key, value in params.items() if key != 'page'}
+                with self.subTest(mode=mode, **params), \
+                        self.settings(EXPENSES_PAGINATION_MODE=mode):
+                    url = reverse('expenses:expense-list')
+                    response, queries = self.capture(url, params)
+                    self.check_list_plans(queries, params)
+                    cursor = getattr(response.context['page_obj'], 'next_cursor', None)
+                    if cursor:
+                        response, queries = self.capture(url, {**params, 'cursor': cursor})
+                        self.check_list_plans(queries, params)
+                        response, queries = self.capture(
+                            url, {**params, 'cursor': response.context['page_obj'].previous_cursor})
+                        self.check_list_plans(queries, params)
+
+    def test_category_list(self):
+        for sort in ('', 'name', '-name'):
+            with self.subTest(sort=sort):
+                response, queries = self.capture(reverse('expenses:category-list'), {'sort': sort})
+                self.check_plans(queries)
+        # Ordering by a stat computes it for every category: one index seek
+        # per category and column, then a sort of the category rows.
+        for sort in ('count', '-total', 'first', '-last'):
+            with self.subTest(sort=sort):
+                response, queries = self.capture(reverse('expenses:category-list'), {'sort': sort})
+                self.check_plans(queries, 'per-category stats are computed per query',
+                                 allow_scan=('expenses_category',))
+
+    def test_reports(self):
+        queryset = Expense.objects.all()
+        food = Category.objects.get(pk=1)
+        cases = [
+            (queryset, None),
+            (queryset, {}),
+            (queryset.filter(category__in=[food]), {'categories': [food]}),
+            (queryset.filter(category__in=[food]), None),
+            (queryset.filter(date__range=('2022-01-01', '2022-01-31')),
+             {'date_from': datetime.date(2022, 1, 1), 'date_to': datetime.date(2022, 1, 31)}),
+            (queryset.filter(date__gte='2022-01-05'), None),
+        ]
+        for report in (summary_per_category, summary_per_year_month):
+            for filtered, filters in cases:
+                with self.subTest(report=report.__name__, filters=filters, sql=str(filtered.query)):
+                    with CaptureQueriesContext(connection) as ctx:
+                        report(filtered, filters)
+                    self.check_plans(ctx.captured_queries)
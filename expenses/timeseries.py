@@ -0,0 +1,249 @@
+"""
+Time-series expense reports: totals per day, week, month, quarter or year,
+broken down by category, with running totals and period-over-period deltas.
+
+The data comes from one streamed query of `(category_id, date, cents)`
+rows, already summed per day and category by the database, so what reaches
+Python is bounded by days x categories rather than by the number of
+expenses. For month, quarter and year buckets over month-aligned filters
+the rows come from the ExpenseRollup table instead. Amounts are integer
+cents throughout (`array('q')` columns); they only become Decimals when a
+table is rendered.
+"""
+import datetime
+from array import array
+from dataclasses import dataclass
+from decimal import Decimal
+from itertools import accumulate
+from operator import add
+
+from asgiref.sync import sync_to_async
+from django.db.models import F, IntegerField, Sum
+from django.db.models.functions import Cast, Round
+
+from .models import ExpenseRollup
+from .profiling import span
+from .reports import _category_names, rollup_lookups
+
+GRANULARITIES = ('day', 'week', 'month', 'quarter', 'year')
+CHUNK_SIZE = 5000
+
+
+def period_start(date, granularity):
+    """First day of the `granularity` bucket holding `date` (weeks start on Monday)."""
+    if granularity == 'day':
+        return date
+    if granularity == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if granularity == 'month':
+        return date.replace(day=1)
+    if granularity == 'quarter':
+        return date.replace(month=(date.month - 1) // 3 * 3 + 1, day=1)
+    if granularity == 'year':
+        return date.replace(month=1, day=1)
+    raise ValueError(f'Unknown granularity {granularity!r}, expected one of {GRANULARITIES}.')
+
+
+def next_period(start, granularity):
+    if granularity == 'day':
+        return start + datetime.timedelta(days=1)
+    if granularity == 'week':
+        return start + datetime.timedelta(days=7)
+    months = {'month': 1, 'quarter': 3, 'year': 12}[granularity]
+    month = start.month - 1 + months
+    return start.replace(year=start.year + month // 12, month=month % 12 + 1)
+
+
+def period_label(start, granularity):
+    if granularity == 'week':
+        year, week, _ = start.isocalendar()
+        return f'{year}-W{week:02d}'
+    if granularity == 'month':
+        return start.strftime('%Y-%m')
+    if granularity == 'quarter':
+        return f'{start.year}-Q{(start.month - 1) // 3 + 1}'
+    if granularity == 'year':
+        return str(start.year)
+    return start.isoformat()
+
+
+def cents_to_decimal(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def daily_rows(queryset, filters=None, granularity='day'):
+    """
+    The `(category_id, date, cents)` query the report is built from: one row
+    per category and day, or per category and month from the rollups when
+    they can answer `filters` at this granularity.
+    """
+    lookups = rollup_lookups(filters)
+    if lookups is not None and granularity in ('month', 'quarter', 'year'):
+        return (
+            ExpenseRollup.objects.filter(lookups)
+            .order_by()
+            .values_list('category_id', 'year', 'month', 'total')
+        ), True
+    cents = Cast(Round(F('amount') * 100), IntegerField())
+    return (
+        queryset
+        .order_by()
+        .values('category_id', 'date')
+        .annotate(cents=Sum(cents))
+        .values_list('category_id', 'date', 'cents')
+    ), False
+
+
+@dataclass
+class Row:
+    period: datetime.date
+    label: str
+    amounts: list
+    running: list
+    deltas: list
+    total: Decimal
+    running_total: Decimal
+    delta: Decimal
+
+
+class TimeSeries:
+    """
+    Period x category pivot of integer cents.
+
+    `cells` is one flat `array('q')` of `len(periods) * len(columns)`
+    cells, period-major; `totals` and `running_totals` hold one value per
+    period.
+    """
+
+    def __init__(self, granularity, periods, columns, cells):
+        self.granularity = granularity
+        self.periods = periods
+        self.columns = columns
+        self.cells = cells
+        width = len(columns)
+        self.totals = array('q', (
+            sum(cells[i * width:(i + 1) * width]) for i in range(len(periods))))
+        self.running_totals = array('q', accumulate(self.totals))
+
+    @classmethod
+    def from_rows(cls, rows, granularity, rollup=False):
+        """
+        Bucket `(category_id, date, cents)` rows, or `(category_id, year,
+        month, total)` rollup rows, into a TimeSeries whose columns are
+        category ids (see `with_names`).
+        """
+        period_start(datetime.date.min, granularity)  # validate up front
+        categories, days, amounts = array('q'), array('q'), array('q')
+        column_of = {}
+        for row in rows:
+            if rollup:
+                category_id, year, month, total = row
+                day, cents = datetime.date(year, month, 1), int(total.scaleb(2))
+            else:
+                category_id, day, cents = row
+            categories.append(column_of.setdefault(category_id, len(column_of)))
+            days.append(day.toordinal())
+            amounts.append(cents)
+        columns = list(column_of)
+        if not days:
+            return cls(granularity, [], columns, array('q'))
+
+        periods = []
+        start = period_start(datetime.date.fromordinal(min(days)), granularity)
+        last = datetime.date.fromordinal(max(days))
+        while start <= last:
+            periods.append(start)
+            try:
+                start = next_period(start, granularity)
+            except (OverflowError, ValueError):  # the last period of year 9999
+                break
+        # Map each distinct day to its bucket once; after that every row is
+        # an index computation and an add into the flat pivot.
+        index = {period: i for i, period in enumerate(periods)}
+        bucket_of = {
+            ordinal: index[period_start(datetime.date.fromordinal(ordinal), granularity)]
+            for ordinal in set(days)
+        }
+        width = len(columns)
+        cells = array('q', [0]) * (len(periods) * width)
+        for column, day, cents in zip(categories, days, amounts):
+            cells[bucket_of[day] * width + column] += cents
+        return cls(granularity, periods, columns, cells)
+
+    def with_names(self, names):
+        """
+        Relabel category-id columns with their names (`names` maps id to
+        name; missing ids are uncategorized, '-') and sort them by name.
+        """
+        labels = [names.get(pk, '-') for pk in self.columns]
+        columns = sorted(set(labels))
+        index = {label: i for i, label in enumerate(columns)}
+        old, new = len(self.columns), len(columns)
+        cells = array('q', [0]) * (len(self.periods) * new)
+        # Whole columns move with strided slice assignment; only columns
+        # sharing a label (uncategorized ids) need adding up.
+        filled = set()
+        for k, label in enumerate(labels):
+            j = index[label]
+            column = self.cells[k::old]
+            if j in filled:
+                column = array('q', map(add, cells[j::new], column))
+            cells[j::new] = column
+            filled.add(j)
+        return TimeSeries(self.granularity, self.periods, columns, cells)
+
+    def as_dict(self):
+        """JSON-serializable form, read back by `from_dict`."""
+        return {
+            'granularity': self.granularity,
+            'periods': [period.isoformat() for period in self.periods],
+            'columns': self.columns,
+            'cells': self.cells.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['granularity'], [datetime.date.fromisoformat(p) for p in data['periods']],
+                   data['columns'], array('q', data['cells']))
+
+    def column(self, name):
+        """Cents per period for one column."""
+        return self.cells[self.columns.index(name)::len(self.columns)]
+
+    def rows(self):
+        """One Row per period with Decimal amounts, for templates and the API."""
+        width = len(self.columns)
+        running = array('q', [0]) * width
+        previous = None
+        rows = []
+        for i, period in enumerate(self.periods):
+            amounts = self.cells[i * width:(i + 1) * width]
+            for j, value in enumerate(amounts):
+                running[j] += value
+            rows.append(Row(
+                period=period,
+                label=period_label(period, self.granularity),
+                amounts=[cents_to_decimal(value) for value in amounts],
+                running=[cents_to_decimal(value) for value in running],
+                deltas=[None if previous is None else cents_to_decimal(value - before)
+                        for value, before in zip(amounts, previous or amounts)],
+                total=cents_to_decimal(self.totals[i]),
+                running_total=cents_to_decimal(self.running_totals[i]),
+                delta=None if i == 0 else cents_to_decimal(self.totals[i] - self.totals[i - 1]),
+            ))
+            previous = amounts
+        return rows
+
+
+@span('time_series')
+def time_series(queryset, granularity='month', filters=None, chunk_size=CHUNK_SIZE):
+    """Pivot the expenses in `queryset` (matching `filters`) per period and category."""
+    query, rollup = daily_rows(queryset, filters, granularity)
+    series = TimeSeries.from_rows(query.iterator(chunk_size=chunk_size), granularity, rollup)
+    return series.with_names(dict(_category_names(series.columns)))
+
+
+async def atime_series(queryset, granularity='month', filters=None, chunk_size=CHUNK_SIZE):
+    # Django 4.2's aiterator() runs the query of a values_list() in the event
+    # loop, so the whole streamed pivot runs in a worker thread instead.
+    return await sync_to_async(time_series)(queryset, granularity, filters, chunk_size)
@@ -1,7 +1,10 @@
 from django.views.generic import CreateView, UpdateView, DeleteView
 from django.urls import path, reverse_lazy
+from .api import (CategorySummaryApi, ExpenseCollectionApi, ExpenseDetailApi, TimeSeriesApi,
+                  YearMonthSummaryApi)
 from .models import Expense, Category
-from .views import ExpenseListView, CategoryListView
+from .views import (ExpenseListView, ExpenseExportView, ExpenseImportView, ExpenseReportView,
+                    CategoryListView)
 
 
 urlpatterns = [
@@ -16,9 +19,18 @@ urlpatterns = [
             template_name='generic_update.html'
          ),
          name='expense-create'),
+    path('expense/export/',
+         ExpenseExportView.as_view(),
+         name='expense-export'),
+    path('expense/import/',
+         ExpenseImportView.as_view(),
+         name='expense-import'),
+    path('expense/report/',
+         ExpenseReportView.as_view(),
+         name='expense-report'),
     path('expense/<int:pk>/edit/',
          UpdateView.as_view(
-            model=Expense,
+            queryset=Expense.objects.select_related('category'),
             fields='__all__',
             success_url=reverse_lazy('expenses:expense-list'),
             template_name='generic_update.html'
@@ -26,7 +38,7 @@ urlpatterns = [
          name='expense-edit'),
     path('expense/<int:pk>/delete/',
          DeleteView.as_view(
-            model=Expense,
+            queryset=Expense.objects.select_related('category'),
             success_url=reverse_lazy('expenses:expense-list'),
             template_name='generic_delete.html'
          ),
@@ -50,4 +62,20 @@ urlpatterns = [
             template_name='generic_delete.html'
          ),
          name='category-delete'),
+
+    path('api/expenses/',
+         ExpenseCollectionApi.as_view(),
+         name='api-expense-list'),
+    path('api/expenses/<int:pk>/',
+         ExpenseDetailApi.as_view(),
+         name='api-expense-detail'),
+    path('api/summary/category/',
+         CategorySummaryApi.as_view(),
+         name='api-summary-category'),
+    path('api/summary/year-month/',
+         YearMonthSummaryApi.as_view(),
+         name='api-summary-year-month'),
+    path('api/reports/timeseries/',
+         TimeSeriesApi.as_view(),
+         name='api-timeseries'),
 ]
@@ -1,30 +1,227 @@
+import csv
+import io
+
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.db.models import F
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views.generic.base import TemplateView, View
+from django.views.generic.edit import FormView
 from django.views.generic.list import ListView
 
-from .forms import ExpenseSearchForm
+from . import caching, exporters, jobs
+from .forms import ExpenseImportForm, ExpenseSearchForm, TimeSeriesForm
+from .importers import ExpenseImporter, iter_rows
 from .models import Expense, Category
-from .reports import summary_per_category
+from .pagination import CachedCountPaginator, KeysetPaginator
+from .profiling import span
+from .reports import summary_per_category, summary_per_year_month
+from .timeseries import time_series
+
+
+class ExpenseFilterMixin:
+    def filter_expenses(self, queryset):
+        """
+        Apply ExpenseSearchForm from the query string to `queryset`.
+        Returns `(form, queryset, filters)`; `filters` is the cleaned data,
+        or empty when the form is invalid and nothing was applied.
+        """
+        form = ExpenseSearchForm(self.request.GET)
+        filters = {}
+        with span('form'):
+            valid = form.is_valid()
+        if valid:
+            with span('filter'):
+                queryset = form.order_queryset(form.filter_queryset(queryset))
+            filters = form.cleaned_data
+        return form, queryset, filters
+
+
+class FragmentCacheMixin:
+    """Context for `{% cache %}`-ing template fragments per data version and query string."""
+
+    def get_context_data(self, **kwargs):
+        return super().get_context_data(
+            fragment_cache=caching.get_cache_alias(),
+            fragment_cache_timeout=caching.get_cache().default_timeout,
+            fragment_cache_key=(f'{caching.data_version()}:'
+                                f'{caching.normalize_params(self.request.GET)}'),
+            **kwargs)
 
 
-class ExpenseListView(ListView):
+class BackgroundReportMixin:
+    """
+    Reports computed in the request, or by the report worker when
+    `settings.EXPENSES_BACKGROUND_REPORTS` is set (see expenses.jobs).
+    """
+
+    def get_report(self, kind, params, compute):
+        """`(value, refreshing)`; `value` is None until a first result exists."""
+        values, refreshing = self.get_reports(params, {kind: compute})
+        return values[kind], refreshing
+
+    def get_reports(self, params, computes):
+        """
+        `({kind: value}, refreshing)` for the reports in `computes`, a dict
+        of kind -> callable computing it in the request; `refreshing` is
+        whether any of them is still pending.
+        """
+        if getattr(settings, 'EXPENSES_BACKGROUND_REPORTS', False):
+            latest = jobs.latest_many(list(computes), params)
+            return ({kind: value for kind, (value, _) in latest.items()},
+                    any(refreshing for _, refreshing in latest.values()))
+        return {kind: caching.get_or_set(kind, params, compute)
+                for kind, compute in computes.items()}, False
+
+
+class ExpenseListView(ExpenseFilterMixin, BackgroundReportMixin, FragmentCacheMixin, ListView):
     model = Expense
     paginate_by = 5
+    paginator_class = CachedCountPaginator
+    # 'offset' (numbered pages) or 'keyset' (cursor pages); None defers to
+    # settings.EXPENSES_PAGINATION_MODE.
+    pagination_mode = None
+    query_budget = 7
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('category')
+
+    def get_pagination_mode(self):
+        return self.pagination_mode or getattr(settings, 'EXPENSES_PAGINATION_MODE', 'offset')
+
+    @span('paginate')
+    def paginate_queryset(self, queryset, page_size):
+        if self.get_pagination_mode() != 'keyset':
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return paginator, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         queryset = object_list if object_list is not None else self.object_list
 
-        form = ExpenseSearchForm(self.request.GET)
-        if form.is_valid():
-            name = form.cleaned_data.get('name', '').strip()
-            if name:
-                queryset = queryset.filter(name__icontains=name)
+        form, queryset, filters = self.filter_expenses(queryset)
+
+        pagination_query = self.request.GET.copy()
+        for key in ('page', 'cursor'):
+            pagination_query.pop(key, None)
+        summary_params = caching.normalize_params(pagination_query)
+
+        summaries, refreshing = self.get_reports(summary_params, {
+            'summary-per-category': lambda: summary_per_category(queryset, filters),
+            'summary-per-year-month': lambda: summary_per_year_month(queryset, filters),
+        })
 
         return super().get_context_data(
             form=form,
             object_list=queryset,
-            summary_per_category=summary_per_category(queryset),
+            pagination_query=f'{pagination_query.urlencode()}&' if pagination_query else '',
+            summary_per_category=summaries['summary-per-category'],
+            summary_per_year_month=summaries['summary-per-year-month'],
+            summaries_refreshing=refreshing,
             **kwargs)
 
-class CategoryListView(ListView):
+
+class ExpenseExportView(ExpenseFilterMixin, View):
+    """Stream every expense the list filters select as CSV or NDJSON."""
+    chunk_size = exporters.CHUNK_SIZE
+    query_budget = 2
+
+    def get(self, request, *args, **kwargs):
+        format = request.GET.get('format', 'csv')
+        if format not in exporters.FORMATS:
+            raise Http404(f'Unknown export format {format!r}.')
+        form, queryset, filters = self.filter_expenses(Expense.objects.all())
+        if not form.is_valid():
+            # Exporting everything instead would look like a successful export.
+            return JsonResponse(
+                {'error': 'Invalid filters.', 'errors': form.errors.get_json_data()}, status=400)
+        content_type, extension = exporters.FORMATS[format]
+        response = StreamingHttpResponse(
+            exporters.export(queryset, format, self.chunk_size), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="expenses.{extension}"'
+        return response
+
+
+class ExpenseReportView(ExpenseFilterMixin, BackgroundReportMixin, TemplateView):
+    """Totals per period and category for the list filters, with running totals and deltas."""
+    template_name = 'expenses/expense_report.html'
+    query_budget = 4
+
+    def get_context_data(self, **kwargs):
+        form, queryset, filters = self.filter_expenses(Expense.objects.all())
+        report_form = TimeSeriesForm(self.request.GET)
+        granularity = report_form.cleaned_data['granularity'] if report_form.is_valid() else 'month'
+        series, refreshing = self.get_report(
+            'timeseries', caching.normalize_params(self.request.GET),
+            lambda: time_series(queryset, granularity, filters))
+        return super().get_context_data(
+            form=form, report_form=report_form, series=series,
+            rows=series.rows() if series is not None else [], refreshing=refreshing, **kwargs)
+
+
+class ExpenseImportView(FormView):
+    form_class = ExpenseImportForm
+    template_name = 'expenses/expense_import.html'
+    batch_size = 1000
+    max_reported_errors = 100
+
+    def form_valid(self, form):
+        importer = ExpenseImporter(batch_size=self.batch_size,
+                                   dry_run=form.cleaned_data['dry_run'],
+                                   max_errors=self.max_reported_errors)
+        # utf-8-sig: spreadsheet exports often start with a byte order mark.
+        stream = io.TextIOWrapper(form.cleaned_data['file'], encoding='utf-8-sig', newline='')
+        try:
+            result = importer.run(iter_rows(stream, form.cleaned_data['format']))
+        except (ValueError, csv.Error) as e:
+            form.add_error('file', f'Cannot parse file: {e}')
+            return self.form_invalid(form)
+        return self.render_to_response(self.get_context_data(
+            form=form,
+            result=result,
+            errors=result.errors))
+
+
+class CategoryListView(FragmentCacheMixin, ListView):
     model = Category
     paginate_by = 5
+    paginator_class = CachedCountPaginator
+    query_budget = 2
+    # `?sort=` value (prefix with '-' for descending) -> annotation.
+    sort_fields = {
+        'name': 'name',
+        'count': 'expense_count',
+        'total': 'expense_total',
+        'first': 'first_date',
+        'last': 'last_date',
+    }
+
+    def get_queryset(self):
+        return super().get_queryset().with_stats()
 
+    def get_sort(self):
+        sort = self.request.GET.get('sort', '')
+        return sort if sort.lstrip('-') in self.sort_fields else 'name'
+
+    def get_ordering(self):
+        sort = self.get_sort()
+        field = self.sort_fields[sort.lstrip('-')]
+        if field == 'name':
+            return sort  # unique, no tiebreak needed
+        # Categories without expenses have no dates; list them last either way.
+        nulls_last = True if field.endswith('_date') else None
+        if sort.startswith('-'):
+            return F(field).desc(nulls_last=nulls_last), '-pk'
+        return F(field).asc(nulls_last=nulls_last), 'pk'
+
+    def get_context_data(self, **kwargs):
+        pagination_query = self.request.GET.copy()
+        pagination_query.pop('page', None)
+        return super().get_context_data(
+            sort=self.get_sort(),
+            pagination_query=f'{pagination_query.urlencode()}&' if pagination_query else '',
+            **kwargs)
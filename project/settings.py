@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,8 +49,33 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'expenses.profiling.ProfilingMiddleware',
+    'expenses.querybudget.QueryBudgetMiddleware',
 ]
 
+# Request profiling (expenses.profiling). Server-Timing headers default to
+# DEBUG; EXPENSES_PROFILE_LOG collects one JSON line per request for
+# `manage.py profile_report`, and a non-zero EXPENSES_PROFILE_SAMPLE_RATE
+# runs cProfile on that fraction of requests, keeping the pstats files of
+# those slower than EXPENSES_PROFILE_SLOW_MS in EXPENSES_PROFILE_DIR.
+EXPENSES_PROFILE_LOG = None
+EXPENSES_PROFILE_SAMPLE_RATE = 0
+EXPENSES_PROFILE_SLOW_MS = 500
+EXPENSES_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# Maximum number of SQL queries per view, keyed by namespaced URL name.
+# Class-based views may declare a `query_budget` attribute instead.
+QUERY_BUDGETS = {
+    'expenses:expense-create': 8,
+    'expenses:expense-edit': 9,
+    'expenses:expense-delete': 6,
+    'expenses:category-create': 3,
+    'expenses:category-delete': 4,
+}
+
+# Raise instead of logging a warning when a view exceeds its query budget.
+QUERY_BUDGET_RAISE = False
+
 ROOT_URLCONF = 'project.urls'
 
 TEMPLATES = [
@@ -81,6 +107,84 @@ DATABASES = {
     }
 }
 
+# Production profile, enabled with EXPENSES_DB_PROFILE=production: WAL and
+# tuned pragmas on every connection (expenses.backends.sqlite3), persistent
+# connections, and reads of expense data on a read-only connection while
+# writes go through the default alias with BEGIN IMMEDIATE, so concurrent
+# writers queue instead of failing. See expenses.routers.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    # With WAL, NORMAL only syncs at checkpoints: a power loss can drop the
+    # last commits but never corrupts the database.
+    'synchronous': 'normal',
+    'cache_size': -64000,  # KiB, i.e. 64 MB per connection
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+    'busy_timeout': 5000,
+}
+
+if os.environ.get('EXPENSES_DB_PROFILE') == 'production':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'expenses.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+                'pragmas': SQLITE_PRAGMAS,
+            },
+        },
+        'replica': {
+            'ENGINE': 'expenses.backends.sqlite3',
+            'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # journal_mode is a property of the file, set by the writer.
+                'pragmas': {
+                    **{k: v for k, v in SQLITE_PRAGMAS.items() if k != 'journal_mode'},
+                    'query_only': 'on',
+                },
+            },
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+    DATABASE_ROUTERS = ['expenses.routers.ReadReplicaRouter']
+    EXPENSES_READ_DATABASE = 'replica'
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Expense list summaries, counts and rendered tables. The data version
+    # that write invalidation bumps lives in this cache too, so it must be
+    # shared by every process that writes expenses: server workers as well
+    # as import_expenses, generate_expenses and rebuild_rollups. Local
+    # memory only suits a single server process with no command-line writes.
+    'expenses': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'expenses',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
+EXPENSES_CACHE_ALIAS = 'expenses'
+
+# Compute the list summaries and the time-series report with
+# `manage.py run_report_worker` instead of inside the request: pages show
+# the last completed result and a "refreshing" note while a newer one is
+# computed (expenses.jobs).
+EXPENSES_BACKGROUND_REPORTS = False
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators